@@ -2,13 +2,36 @@
 # https://developer.ebay.com/api-docs/buy/browse/resources/item_summary/methods/search
 import aiohttp
 import asyncio
+from datetime import datetime, timedelta, timezone
 
-from settings.settings import DEFAULT_CALL_PARAMS, MAX_CACHE_LEN
+from logs.mylogging import logger
+from settings.settings import (
+    DEFAULT_CALL_PARAMS,
+    EBAY_API_URL,
+    MAX_CACHE_LEN,
+    SEEN_ITEM_END_GRACE,
+    WATERMARK_OVERLAP,
+    WATERMARK_GRANULARITY,
+    EBAY_MAX_OFFSET,
+    EBAY_PAGE_BUDGET,
+    MAX_EBAY_PAGE_BUDGET,
+    EBAY_MAX_RETRIES,
+    EBAY_RETRY_AFTER_DEFAULT,
+)
 from settings.background_objects import (
     ebay_call_counter,
+    ebay_client,
+    ebay_rate_limiter,
     refreshing_ebay_token,
+    search_cache,
 )
 from utils.helpers import textify_search_item
+from utils.json_backend import loads
+from ebay.ebay_filter import split_filter
+from ebay.ebay_item import ItemSummary, parse_ebay_date
+from ebay.ebay_token import EbayTokenError
+from ebay.seen_items import SeenItems
+from utils.rate_limit import retry_after_seconds
 
 
 # -----------------------------------------------------------------HELPERS------------------------------------------------------
@@ -27,47 +50,266 @@ def user_data_params_to_actual(params):
     return params
 
 
+def canonical_filter(filter_line) -> str:
+    if type(filter_line) in (tuple, list):
+        filter_line = ",".join(filter_line)
+    tokens = []
+    for token in split_filter(filter_line):
+        name, _, value = token.strip().partition(":")
+        if not name:
+            continue
+        if value.startswith("{") and value.endswith("}"):
+            value = "{" + "|".join(sorted(value[1:-1].split("|"))) + "}"
+        tokens.append(f"{name.strip()}:{value.strip()}")
+    return ",".join(sorted(tokens))
+
+
+def search_page_budget(params) -> int:
+    # 'pages' is ours, not eBay's: how many result pages a search may read
+    try:
+        pages = int(params.get("pages", EBAY_PAGE_BUDGET))
+    except (TypeError, ValueError):
+        pages = EBAY_PAGE_BUDGET
+    return min(max(pages, 1), MAX_EBAY_PAGE_BUDGET)
+
+
+def canonical_search_params(params, since: str = None) -> dict:
+    """the same eBay search written by different users looks the same here"""
+    actual = user_data_params_to_actual(dict(params))
+    actual.pop("pages", None)
+    actual["filter"] = canonical_filter(actual["filter"])
+    if since and actual.get("sort") == "newlyListed":
+        # only the listings after the watermark
+        actual["filter"] = canonical_filter(
+            f"{actual['filter']},itemStartDate:[{since}..]"
+        )
+    if actual.get("q"):
+        actual["q"] = " ".join(str(actual["q"]).lower().split())
+    return {k: str(actual[k]) for k in sorted(actual)}
+
+
+def search_cache_key(actual_params: dict) -> tuple:
+    return tuple(actual_params.items())
+
+
+# -----------------------------------------------------------------WATERMARKS------------------------------------------------
+EBAY_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def advance_watermark(watermark: str, items: list, polled_at: datetime) -> str:
+    """the newest listing seen by a search, or the poll time if nothing came"""
+    created = [parse_ebay_date(sr.creation_date) for sr in items]
+    created = [date for date in created if date]
+    newest = max(created) if created else polled_at
+
+    # listings reach the search index late; dedup takes care of the overlap
+    newest -= timedelta(seconds=WATERMARK_OVERLAP)
+
+    # floored, so that close watermarks of different users share a cached search
+    floored = newest.timestamp() // WATERMARK_GRANULARITY * WATERMARK_GRANULARITY
+    new_watermark = datetime.fromtimestamp(floored, timezone.utc).strftime(
+        EBAY_DATE_FORMAT
+    )
+    if watermark and watermark > new_watermark:  # never goes back
+        return watermark
+    return new_watermark
+
+
 # -----------------------------------------------------------------GET RAW RESULT------------------------------------------------
-async def get_ebay_search_result(params: dict):
-    endpoint = "https://api.ebay.com/buy/browse/v1/item_summary/search"
-    headers = {
-        "Authorization": f"Bearer {refreshing_ebay_token.value}",
-        "Content-Type": "application/json",
+class EbaySearchError(Exception):
+    pass
+
+
+async def get_ebay_search_result(params: dict, since: str = None):
+    results = []
+    try:
+        async for page in iter_ebay_search(params, since=since):
+            results += page
+    except EbaySearchError as e:
+        return str(e)
+    return results  # returns a list if all is ok
+
+
+async def iter_ebay_search(
+    params: dict,
+    since: str = None,
+    seen: SeenItems = None,
+    offset: int = 0,
+    cursor: dict = None,
+):
+    """yields pages of item summaries as they arrive, up to the search page budget;
+    cursor gets "next_offset": where the results go on past the budget, None if read"""
+    page_budget = search_page_budget(params)
+    actual_params = canonical_search_params(params, since=since)
+    # newest first: a seen item means the rest is old news
+    # not when reading on: the listings moved down meanwhile, seen ones come again
+    stop_at_seen = (
+        seen is not None and actual_params.get("sort") == "newlyListed" and not offset
+    )
+    if cursor is not None:
+        cursor["next_offset"] = None
+
+    first_page = await get_ebay_search_page(actual_params, offset)
+    items = first_page["itemSummaries"]
+    reached_seen = stop_at_seen and any(is_seen(sr, seen) for sr in items)
+    limit = first_page["limit"] or len(items)
+    end_offset = offset + page_budget * limit
+    if cursor is not None and limit and not reached_seen:
+        if first_page["total"] > end_offset and end_offset <= EBAY_MAX_OFFSET:
+            cursor["next_offset"] = end_offset
+    yield items
+
+    last_offset = min(first_page["total"], end_offset)
+    if reached_seen or not limit or last_offset <= offset + limit:
+        return
+
+    # the rest of the pages at once; yielded in order
+    pages = [
+        asyncio.ensure_future(get_ebay_search_page(actual_params, page_offset))
+        for page_offset in range(offset + limit, last_offset, limit)
+    ]
+    try:
+        for page in pages:
+            items = (await page)["itemSummaries"]
+            reached_seen = stop_at_seen and any(is_seen(sr, seen) for sr in items)
+            yield items
+            if reached_seen:
+                if cursor is not None:
+                    cursor["next_offset"] = None
+                break
+    finally:
+        for page in pages:
+            page.cancel()
+
+
+async def get_ebay_search_page(actual_params: dict, offset: int) -> dict:
+    if offset:
+        actual_params = dict(actual_params, offset=str(offset))
+    result = await search_cache.get(
+        search_cache_key(actual_params), lambda: fetch_ebay_search(actual_params)
+    )
+    if type(result) == str:
+        raise EbaySearchError(result)
+    return result
+
+
+# item summaries only: no refinement histograms in the response
+LEAN_RESPONSE = {"fieldgroups": "MATCHING_ITEMS"}
+
+
+async def fetch_ebay_search(actual_params: dict):
+    endpoint = f"{EBAY_API_URL}/buy/browse/v1/item_summary/search"
+    result = await ebay_get(endpoint, dict(actual_params, **LEAN_RESPONSE))
+    if type(result) == str:
+        return result
+
+    if not result.get("itemSummaries") and result.get("total") != 0:
+        return f"Error occurred: {result}"
+
+    # a page; an empty one is not an error
+    return {
+        "itemSummaries": [
+            ItemSummary.from_dict(sr) for sr in result.get("itemSummaries", [])
+        ],
+        "total": result.get("total", 0),
+        "limit": result.get("limit", 0),
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            endpoint, headers=headers, params=user_data_params_to_actual(params)
-        ) as response:
-            result = await response.json()
-            ebay_call_counter.call()
 
-            if not result.get("itemSummaries"):
-                return f"Error occurred: {result}"
+async def get_ebay_item(item_id: int):
+    """one item by its legacy id; an ItemSummary or an error string"""
+    endpoint = f"{EBAY_API_URL}/buy/browse/v1/item/get_item_by_legacy_id"
+    result = await ebay_get(endpoint, {"legacy_item_id": str(item_id)})
+    if type(result) == str:
+        return result
+    if not result.get("legacyItemId"):
+        return f"Error occurred: {result}"
+    return ItemSummary.from_dict(result)
 
-            return result.get("itemSummaries")  # returns a list if all is ok
+
+async def ebay_get(endpoint: str, params: dict):
+    """every eBay call: token, rate limit, daily budget, 401 and 429 handling;
+    the decoded json, or an error string on any failure"""
+    session = await ebay_client.open()  # shared keep-alive pool
+
+    replayed = False
+    for attempt in range(EBAY_MAX_RETRIES + 1):
+        try:
+            token = await refreshing_ebay_token.get()
+        except EbayTokenError as e:
+            return f"Error occurred: {e}"
+
+        await ebay_rate_limiter.acquire()
+        if not ebay_call_counter.reserve():  # the daily hard cap stays on top
+            return "Error occurred: daily eBay API calls limit reached"
+
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+        try:
+            async with session.get(
+                endpoint, headers=headers, params=params
+            ) as response:
+                if response.status == 401 and not replayed:
+                    # the token got revoked or expired early: new one, same request
+                    try:
+                        await refreshing_ebay_token.refresh(stale=token)
+                    except EbayTokenError as e:
+                        return f"Error occurred: {e}"
+                    replayed = True
+                    continue
+
+                if response.status == 429:
+                    # too many requests: everyone waits, nobody fails
+                    retry_after = retry_after_seconds(
+                        response.headers.get("Retry-After"), EBAY_RETRY_AFTER_DEFAULT
+                    )
+                    ebay_rate_limiter.pause(retry_after)
+                    logger.info(f"EBAY 429, ALL CALLS PAUSED FOR {retry_after:.0f}s")
+                    continue
+
+                status, body = response.status, await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return f"Error occurred: eBay connection failed: {type(e).__name__} {e}"
+
+        try:
+            result = loads(body)
+        except ValueError:  # an html error page of a gateway, a cut off body
+            return f"Error occurred: eBay answered {status} with no json"
+        if type(result) != dict:
+            return f"Error occurred: eBay answered {status} with {type(result).__name__}"
+        return result
+
+    return "Error occurred: eBay rate limit, please wait"
 
 
 # -----------------------------------------------------------------PARSE THE RESULT------------------------------------------------
-def parse_ebay_search_output(input_list, user_id, cache: dict = {}):
-    """yilds ready to send text"""
-    if not cache.get(user_id):
-        cache[user_id] = []
+def is_seen(sr: ItemSummary, seen: SeenItems) -> bool:
+    return sr.item_id in seen
+
+
+def parse_ebay_search_output(input_list, seen: SeenItems, journal: list = None):
+    """yilds new items with their ready to send text; journal gets [item_id, end] of each"""
     for sr in input_list:
-        item_id = sr.get("legacyItemId", "")
-        if item_id not in cache[user_id]:
-            cache[user_id] = [item_id] + cache[user_id]
-            if len(cache[user_id]) > MAX_CACHE_LEN:
-                cache[user_id].pop()
-            yield textify_search_item(sr)
+        # end_timestamp 0: only the MAX_CACHE_LEN cap removes the item
+        if sr.item_id is not None and seen.add(sr.item_id, sr.end_timestamp):
+            if journal is not None:
+                journal.append([sr.item_id, sr.end_timestamp])
+            text = textify_search_item(sr)
+            if text is None:
+                continue  # no price or bid: nothing to send, seen all the same
+            yield sr, text
 
 
 # -----------------------------------------------------------------SEE HOW IT WORKS------------------------------------------------
 async def test():
     parameters = {"q": "vintage compressor", "limit": 5}
     results = await get_ebay_search_result(parameters)
-    for i in parse_ebay_search_output(results, 1):
+    seen = SeenItems(MAX_CACHE_LEN, SEEN_ITEM_END_GRACE)
+    for _, i in parse_ebay_search_output(results, seen):
         print(i)
+    await ebay_client.close()
 
 
 if __name__ == "__main__":
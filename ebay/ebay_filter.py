@@ -0,0 +1,11 @@
+# https://developer.ebay.com/api-docs/buy/static/ref-buy-browse-filters.html
+import re
+
+
+# commas inside [..] and {..} belong to the value, not to the filter list
+FILTER_SEPARATOR = re.compile(r",(?![^\[{]*[\]}])")
+
+
+def split_filter(filter_line: str) -> list:
+    """name:value tokens of an eBay filter line, as written"""
+    return FILTER_SEPARATOR.split(filter_line)
@@ -0,0 +1,76 @@
+# https://developer.ebay.com/api-docs/buy/browse/resources/item_summary/methods/search#response.itemSummaries
+from datetime import datetime
+
+
+# -----------------------------------------------------------------DATES------------------------------------------------
+def parse_ebay_date(date_time_str):
+    try:
+        return datetime.fromisoformat(date_time_str.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def ebay_timestamp(date_time_str) -> int:
+    # epoch seconds; 0 if unknown
+    date = parse_ebay_date(date_time_str)
+    if date is None or date.tzinfo is None:
+        return 0
+    return int(date.timestamp())
+
+
+# -----------------------------------------------------------------ITEM RECORD------------------------------------------------
+class ItemSummary:
+    """THE FEW FIELDS OF A BROWSE itemSummary THE BOT READS"""
+
+    __slots__ = (
+        "item_id",
+        "price",
+        "bid_price",
+        "end_date",
+        "end_timestamp",
+        "creation_date",
+        "title",
+        "image",
+    )
+
+    def __init__(
+        self,
+        item_id=None,
+        price=None,
+        bid_price=None,
+        end_date=None,
+        creation_date=None,
+        title=None,
+        image=None,
+        end_timestamp=None,
+    ):
+        self.item_id = item_id  # legacyItemId as int, None if malformed
+        self.price = price  # value strings as eBay sends them
+        self.bid_price = bid_price
+        self.end_date = end_date  # ISO strings, UTC
+        # parsed once here, read by the seen cache and the rendering
+        self.end_timestamp = (
+            ebay_timestamp(end_date) if end_timestamp is None else end_timestamp
+        )
+        self.creation_date = creation_date
+        self.title = title
+        self.image = image  # url
+
+    def __repr__(self):
+        return f"ItemSummary({self.item_id})"
+
+    @classmethod
+    def from_dict(cls, sr: dict):
+        item_id = str(sr.get("legacyItemId") or "").strip()
+        image = sr.get("image") or {}
+        if not image and sr.get("thumbnailImages"):
+            image = sr["thumbnailImages"][0]
+        return cls(
+            item_id=int(item_id) if item_id.isdigit() else None,
+            price=(sr.get("price") or {}).get("value"),
+            bid_price=(sr.get("currentBidPrice") or {}).get("value"),
+            end_date=sr.get("itemEndDate"),
+            creation_date=sr.get("itemCreationDate") or sr.get("itemOriginDate"),
+            title=sr.get("title"),
+            image=image.get("imageUrl"),
+        )
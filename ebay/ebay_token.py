@@ -1,5 +1,4 @@
-import requests
-from settings.settings import ENCODED_CREDENTIALS
+from settings.settings import ENCODED_CREDENTIALS, EBAY_API_URL
 
 # before you continiue....
 
@@ -24,8 +23,13 @@ from settings.settings import ENCODED_CREDENTIALS
 #     return base64_credentials.decode('utf-8')  # Convert bytes back to string
 
 
-def get_app_token():
-    url = "https://api.ebay.com/identity/v1/oauth2/token"
+class EbayTokenError(Exception):
+    pass
+
+
+async def get_app_token(session):
+    """session: an aiohttp session; nothing here blocks the loop"""
+    url = f"{EBAY_API_URL}/identity/v1/oauth2/token"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
         "Authorization": f"Basic {ENCODED_CREDENTIALS}",
@@ -36,8 +40,10 @@ def get_app_token():
         "scope": "https://api.ebay.com/oauth/api_scope",
     }
 
-    response = requests.post(url, headers=headers, data=data)
-    token_info = response.json()
-    return token_info
+    async with session.post(url, headers=headers, data=data) as response:
+        token_info = await response.json(content_type=None)
+        if response.status != 200 or not token_info.get("access_token"):
+            raise EbayTokenError(f"eBay token request failed: {response.status}")
+        return token_info
     # access_token = token_info.get('access_token')
     # return access_token
@@ -0,0 +1,185 @@
+from array import array
+import heapq
+import time
+
+
+# stored format: version byte, varint amount, then oldest to newest
+# version 1: zigzag varint id deltas
+# version 2: zigzag varint id deltas, each followed by a zigzag varint end-minute delta
+FORMAT_VERSION = 2
+
+
+# -----------------------------------------------------------------HELPERS------------------------------------------------
+def write_varint(number: int, out: bytearray):
+    while number > 0x7F:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def read_varint(data: bytes, pos: int):
+    number = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def zigzag(number: int) -> int:
+    return number << 1 if number >= 0 else (-number << 1) - 1
+
+
+def unzigzag(number: int) -> int:
+    return number >> 1 if not number & 1 else -((number + 1) >> 1)
+
+
+def legacy_item_id(value):
+    value = str(value).strip() if value is not None else ""
+    return int(value) if value.isdigit() else None
+
+
+# -----------------------------------------------------------------SEEN ITEMS------------------------------------------------
+class SeenItems:
+    """SEEN legacyItemIds DROPPED WHEN THEIR LISTING ENDS; FIFO CAP AS A BACKSTOP"""
+
+    # convention:
+    # ring holds ids in the order seen, 0 is a slot freed by expiry
+    # the ring has a quarter more slots than the capacity: compacting is rare
+    # members maps a live id to its ring slot, ends holds the end time per slot
+    # expiry is a heap of (end timestamp, id); stale entries are skipped
+
+    __slots__ = (
+        "capacity",
+        "slots",
+        "grace_seconds",
+        "ring",
+        "ends",
+        "start",
+        "size",
+        "members",
+        "expiry",
+    )
+
+    def __init__(self, capacity: int, grace_seconds: int = 0):
+        self.capacity = capacity  # live items at most
+        self.slots = capacity + capacity // 4 + 1
+        self.grace_seconds = grace_seconds  # kept a bit after the end
+        self.ring = array("Q", [0]) * self.slots
+        self.ends = array("Q", [0]) * self.slots  # epoch seconds, 0 is unknown
+        self.start = 0  # the oldest slot
+        self.size = 0  # used slots, freed ones included
+        self.members = {}
+        self.expiry = []
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self):
+        """(id, end timestamp) oldest first"""
+        for i in range(self.size):
+            slot = (self.start + i) % self.slots
+            if self.ring[slot]:
+                yield self.ring[slot], self.ends[slot]
+
+    def add(self, item_id: int, end_timestamp: int = 0) -> bool:
+        """False if already seen"""
+        self.expire()
+        if item_id in self.members:
+            return False
+
+        if len(self.members) >= self.capacity:  # the count cap: the oldest item goes
+            del self.members[self.ring[self.start]]
+            self.ring[self.start] = 0
+            self.expire()  # moves the start past the freed slots
+        if self.size == self.slots:
+            self.compact()  # a quarter of the slots are freed ones by now
+
+        slot = (self.start + self.size) % self.slots
+        self.ring[slot] = item_id
+        self.ends[slot] = end_timestamp
+        self.size += 1
+        self.members[item_id] = slot
+        if end_timestamp:
+            heapq.heappush(self.expiry, (end_timestamp, item_id))
+        return True
+
+    def expire(self, time_now: float = None):
+        """drops the items whose listing has ended"""
+        if time_now is None:
+            time_now = time.time()
+        deadline = time_now - self.grace_seconds
+        while self.expiry and self.expiry[0][0] <= deadline:
+            end_timestamp, item_id = heapq.heappop(self.expiry)
+            slot = self.members.get(item_id)
+            if slot is not None and self.ends[slot] == end_timestamp:
+                del self.members[item_id]
+                self.ring[slot] = 0
+        while self.size and not self.ring[self.start]:
+            self.start = (self.start + 1) % self.slots
+            self.size -= 1
+
+    def compact(self):
+        items = list(self)
+        self.start = 0
+        self.size = 0
+        for item_id, end_timestamp in items:
+            self.ring[self.size] = item_id
+            self.ends[self.size] = end_timestamp
+            self.members[item_id] = self.size
+            self.size += 1
+        # entries of evicted items go as well
+        self.expiry = [(end, item_id) for item_id, end in items if end]
+        heapq.heapify(self.expiry)
+
+    # ----------------------------------------------PERSISTENCE--------------------------------------------
+    def to_bytes(self) -> bytes:
+        self.expire()
+        out = bytearray([FORMAT_VERSION])
+        write_varint(len(self.members), out)
+        previous_id = previous_end = 0
+        for item_id, end_timestamp in self:
+            end_minute = -(-end_timestamp // 60)  # rounded up, never ends earlier
+            write_varint(zigzag(item_id - previous_id), out)
+            write_varint(zigzag(end_minute - previous_end), out)
+            previous_id, previous_end = item_id, end_minute
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, capacity: int, grace_seconds: int = 0):
+        seen = cls(capacity, grace_seconds)
+        if not data or data[0] not in (1, 2):
+            return seen
+        size, pos = read_varint(data, 1)
+        item_id = end_minute = 0
+        for _ in range(size):
+            delta, pos = read_varint(data, pos)
+            item_id += unzigzag(delta)
+            if data[0] == 2:
+                delta, pos = read_varint(data, pos)
+                end_minute += unzigzag(delta)
+            seen.add(item_id, end_minute * 60)
+        return seen
+
+    @classmethod
+    def from_list(cls, item_ids: list, capacity: int, grace_seconds: int = 0):
+        # the old bot_data format: a list of strings, newest first
+        seen = cls(capacity, grace_seconds)
+        for item_id in reversed(item_ids[:capacity]):
+            item_id = legacy_item_id(item_id)
+            if item_id is not None:
+                seen.add(item_id)
+        return seen
+
+    @classmethod
+    def load(cls, stored, capacity: int, grace_seconds: int = 0):
+        if type(stored) == list:
+            return cls.from_list(stored, capacity, grace_seconds)
+        if stored:
+            return cls.from_bytes(bytes(stored), capacity, grace_seconds)
+        return cls(capacity, grace_seconds)
@@ -13,10 +13,29 @@ from settings.background_objects import (
     notifyer,
     ebay_call_counter,
     open_ai_call_counter,
+    ebay_client,
+    search_cache,
+    ebay_rate_limiter,
+    mailing_scheduler,
+    ending_alerts,
+    seen_store,
+    users_cleaner,
+)
+from settings.app import application, send_queue, persistence
+from utils.active_users import active_users
+from utils.ban_index import ban_index
+from utils.broadcast import broadcast, summary
+from utils.delivery import photo_file_ids
+from utils.rendering import render_cache_stats
+from utils.validate_call_params import verdicts, ACCEPT, REJECT, AMBIGUOUS
+from utils.send_queue import PRIORITY_ADMIN
+
+from handlers.role_check import (
+    check_role_decorator,
+    forget_roles,
+    is_user_admin,
+    is_allowed_user,
 )
-from settings.app import application
-
-from handlers.role_check import check_role_decorator, is_user_admin, is_allowed_user
 
 
 # ----------------------------------------------COMMANDS-----------------------------------------------------
@@ -26,10 +45,9 @@ async def ban(update: Update, context: CallbackContext):
     user_id = message_text[4:].strip()
     if user_id == settings.MY_TG_ID:
         return
-    banned_users = context.bot_data.get("banned_users")
-    if not banned_users:
-        context.bot_data["banned_users"] = []
-    context.bot_data["banned_users"].append(user_id)
+    if not ban_index.ban(context.bot_data, user_id):
+        return
+    forget_roles(context)
     await notifyer.log_and_notify_admin(f"user {user_id} banned")
 
 
@@ -37,12 +55,9 @@ async def ban(update: Update, context: CallbackContext):
 async def unban(update: Update, context: CallbackContext):
     message_text = update.message.text
     user_id = message_text[6:].strip()
-    banned_users = context.bot_data.get("banned_users")
-    if not banned_users:
+    if not ban_index.unban(context.bot_data, user_id):
         return
-    if user_id not in context.bot_data["banned_users"]:
-        return
-    context.bot_data["banned_users"].remove(user_id)
+    forget_roles(context)
     await notifyer.log_and_notify_admin(f"user {user_id} unbanned")
 
 
@@ -50,16 +65,20 @@ async def unban(update: Update, context: CallbackContext):
 async def mail_user(update: Update, context: CallbackContext):
     message_to = update.message.text[10:].split("\n")[0].strip()
     message_what = "\n".join(update.message.text.split("\n")[1:])
-    await context.bot.send_message(chat_id=message_to, text=message_what)
+    await context.bot.send_message(
+        chat_id=message_to, text=message_what, rate_limit_args=PRIORITY_ADMIN
+    )
     await notifyer.log_and_notify_admin(f"Admin message delivered")
 
 
 @check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_user_admin])
 async def mail_all_users(update: Update, context: CallbackContext):
     message_text = update.message.text[15:].strip()
-    for k in context.bot_data.get("cache", {}).keys():
-        await context.bot.send_message(chat_id=k, text=message_text)
-    await notifyer.log_and_notify_admin(f"Admin message sent to all active users")
+    recipients = list(active_users(context.bot_data).keys())
+    report = await broadcast(context.bot, recipients, text=message_text)
+    await notifyer.log_and_notify_admin(
+        f"Admin message sent to all active users: {summary(report)}"
+    )
 
 
 @check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_user_admin])
@@ -78,16 +97,46 @@ async def support_off(update: Update, context: CallbackContext):
 
 @check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_user_admin])
 async def get_bot_status(update: Update, context: CallbackContext):
+    pool = ebay_client.stats()
+    searches_cache = search_cache.stats()
+    limiter = ebay_rate_limiter.stats()
+    scheduler = mailing_scheduler.stats()
+    alerts = ending_alerts.stats()
+    rendered = render_cache_stats()
+    outbox = send_queue.stats()
+    photos = photo_file_ids.stats()
+    held = notifyer.alerts.stats()
+    seen = seen_store.stats()
+    expiry = users_cleaner.stats()
+    database = settings.PERSISTENCE_BACKEND.upper()
+    if settings.PERSISTENCE_BACKEND == "sqlite":
+        rows = persistence.stats()
+        database += f": {rows['pending']} rows to write, {rows['written']} written, {rows['skipped']} unchanged, last write {rows['write_time'] * 1000:.0f}ms"
     TEXT = dedent(
         f"""
         {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}\n
         EBAY API-CALLS TODAY: {ebay_call_counter.calls_today()}
         OPENAI API-CALLS TODAY: {open_ai_call_counter.calls_today()}
+        SEARCH INPUT CHECKS: {verdicts[ACCEPT]} accepted, {verdicts[REJECT]} rejected locally, {verdicts[AMBIGUOUS]} sent to OpenAI
+        EBAY HTTP POOL: {pool['open']} open, {pool['idle']} idle, {pool['in_use']} in use
+        EBAY SEARCH CACHE: {searches_cache['entries']} searches, {searches_cache['in_flight']} in flight, {searches_cache['hit_rate']:.0%} hit rate
+        RENDER CACHE: {rendered['entries']} messages, {rendered['hit_rate']:.0%} hit rate
+        PHOTO FILE IDS: {photos['entries']} images, {photos['hit_rate']:.0%} reused
+        EBAY RATE LIMITER: {limiter['waiting']} waiting, wait avg {limiter['avg']:.1f}s, p95 {limiter['p95']:.1f}s, max {limiter['max']:.1f}s, paused {limiter['paused']:.0f}s
+        TELEGRAM SEND QUEUE: {outbox['admin']} admin, {outbox['replies']} replies, {outbox['feed']} feed{' (full)' if outbox['full'] else ''}, wait avg {outbox['wait_avg']:.1f}s, p95 {outbox['wait_p95']:.1f}s, {outbox['retries']} retries, paused {outbox['paused']:.0f}s
 
         ACTIVE TASKS: {len(task_storage)} - {', '.join(task_storage.keys())}
-        ACTIVE USERS: {len(application.bot_data.get('cache',{}))}
+        ACTIVE USERS: {len(active_users(application.bot_data))}
+        INACTIVE USERS: {expiry['freed']} slots freed, {expiry['last_sweep']} last sweep, next in {expiry['next_in'] / 3600:.1f}h, {expiry['entries']} indexed
+        DATABASE: {database}
+        SEEN ITEMS: {seen['users']} users loaded, {seen['dirty']} to write, {seen['writes']} written, last flush {seen['flush_time'] * 1000:.0f}ms
+        MAILING: {scheduler['scheduled']} searches of {scheduler['users']} users scheduled, {scheduler['queued']} queued, {scheduler['running']} running
+        MAILING LAG: avg {scheduler['lag_avg']:.1f}s, max {scheduler['lag_max']:.1f}s
+        MAILING PLAN: {scheduler['calls_per_day']:.0f} eBay calls a day at most, {scheduler['other_calls']} for alerts today, intervals x{scheduler['budget_scale']:.2f} for the budget
+        ENDING ALERTS: {alerts['pending']} pending, next in {alerts['next_in']:.0f}s, {alerts['fired']} sent, {alerts['dropped']} dropped
 
         SUPPORT ON: {notifyer.on}
+        ADMIN ALERTS: {held['windows']} open windows, {held['suppressed']} repeats held back
         """
     )
     await update.message.reply_text(TEXT)
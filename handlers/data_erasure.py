@@ -8,9 +8,9 @@ from telegram.ext import (
     CallbackContext,
 )
 
-from settings.background_objects import users_cleaner
+from settings.background_objects import users_cleaner, ending_alerts
 
-from handlers.role_check import is_registered_user
+from handlers.role_check import forget_roles, is_registered_user
 from handlers.user import pause
 
 # --------------------------------------STATEFUL DELETION CONVERSATION HANDLER--------------------------------------------------
@@ -44,6 +44,8 @@ async def confirm_delete(update: Update, context: CallbackContext) -> int:
         # manually clean from my storage
         user_id = update.message.from_user.id
         users_cleaner.erase_user(user_id)
+        ending_alerts.drop_user(str(user_id))
+        forget_roles(context)
 
         # Send a confirmation message to the user
         await update.message.reply_text(
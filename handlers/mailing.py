@@ -2,64 +2,265 @@ from telegram import Update
 from telegram.ext import CallbackContext
 
 import asyncio
-from datetime import datetime
-from random import randint, shuffle
+from datetime import datetime, timezone
+from random import shuffle
 
-from logs.mylogging import redacted
-from settings.settings import QUEUE_TIME_INERVAL
-from settings.background_tasks import run_background_task, stop_background_task
-from settings.background_objects import ebay_call_counter, notifyer
+from logs.mylogging import logger, redacted
+from settings.settings import (
+    EBAY_SEARCH_TIMEOUT,
+    QUEUE_TIME_INERVAL,
+    MIN_POLL_INTERVAL,
+    MAX_POLL_INTERVAL,
+    TARGET_POLL_YIELD,
+    POLL_YIELD_SMOOTHING,
+)
+from settings.app import application, send_queue
+from settings.background_objects import (
+    ebay_call_counter,
+    ebay_search_semaphore,
+    ending_alerts,
+    mailing_scheduler,
+    notifyer,
+    seen_store,
+)
 
-from ebay.ebay_call import get_ebay_search_result, parse_ebay_search_output
+from utils.helpers import search_meta, textify_ending_alert
+
+from ebay.ebay_call import (
+    EbaySearchError,
+    get_ebay_item,
+    iter_ebay_search,
+    parse_ebay_search_output,
+    advance_watermark,
+    search_page_budget,
+)
+from utils.active_users import mark_active
+from utils.delivery import SENDERS
+from utils.send_queue import PRIORITY_FEED
+
+
+sending = set()  # deliveries handed to the send queue; tasks are kept referenced
 
 
 # ----------------------------------MAILING USERS-------------------------------------------
 def start_mailing_task(update: Update, context: CallbackContext):
-    amount_of_searches = len([k for k in context.user_data.keys() if k.isdigit()])
-    if amount_of_searches > 0:
-        user_id = str(update.message.from_user.id)  # a unique name for a task
-        run_background_task(user_id, mailing, update, context)
+    search_nums = [k for k in context.user_data.keys() if k.isdigit()]
+    if search_nums:
+        user_id = str(update.message.from_user.id)
+        intervals = {  # learned before the pause
+            k: search_meta(context.user_data, k).get("interval") for k in search_nums
+        }
+        pages = {k: search_page_budget(context.user_data[k]) for k in search_nums}
+        mailing_scheduler.schedule_user(user_id, search_nums, intervals, pages)
 
 
 def stop_mailing_task(update: Update, context: CallbackContext):
     user_id = str(update.message.from_user.id)
-    stop_background_task(user_id)
+    mailing_scheduler.unschedule_user(user_id)
 
 
-async def mailing(update: Update, context: CallbackContext):
-    user_id = str(update.message.from_user.id)
-    while context.user_data["status"] == "on":
-        results = await call_ebay(update, context)
-        if results:
-            context.user_data["last_mailed"] = datetime.now()
-            cache = context.bot_data.get("cache")
-            if not cache:
-                context.bot_data["cache"] = {}
-            for i in parse_ebay_search_output(
-                results, user_id, cache=context.bot_data["cache"]
-            ):
-                await update.message.reply_text(i, parse_mode="MarkDownV2")
-                await asyncio.sleep(randint(3, 9))
-        await asyncio.sleep(QUEUE_TIME_INERVAL)
-
-
-async def call_ebay(update: Update, context: CallbackContext) -> list:
-    user_id = str(update.message.from_user.id)
-    results = []
-    for k, v in dict(context.user_data).items():
-        if k.isdigit():  # the convention is searches stored as a number
-            if ebay_call_counter.value <= 0:
-                await notifyer.log_and_notify_admin(
-                    "Exceeded amount of the allowed eBay API calls.", once=True
-                )
-                break
-            raw_result = await get_ebay_search_result(dict(v))
-            if type(raw_result) == list:
-                results += raw_result
+async def mailing(user_id: str, search_nums: list):
+    """SCHEDULER JOB: the searches of a user that are due now"""
+    user_data = application.user_data.get(int(user_id))
+    if not user_data or user_data.get("status") != "on":
+        mailing_scheduler.unschedule_user(user_id)
+        return
+
+    # backpressure: no new polls while Telegram is behind with the found items
+    await send_queue.wait_for_room()
+
+    alert = user_data.get("ending_alert")  # opted in to "ending soon" alerts
+    mode = user_data.get("delivery", "items")
+    packed = []  # the items of the cycle, for digests and albums
+
+    # pages are sent as they arrive
+    seen = await seen_store.get(user_id)
+    polled = {search_num: [0, 0] for search_num in search_nums}  # found, new
+    answered = set()  # searches eBay answered; failed ones teach nothing
+    async for search_num, results in call_ebay(
+        user_id, user_data, search_nums, seen, answered
+    ):
+        if not results:
+            continue
+        user_data["last_mailed"] = datetime.now()
+        application.mark_data_for_update_persistence(user_ids=int(user_id))
+        shuffle(results)
+        polled[search_num][0] += len(results)
+        for sr, i in parse_ebay_search_output(
+            results, seen, journal=seen_store.journal(user_id)
+        ):
+            polled[search_num][1] += 1
+            if mode == "items":
+                # paced by the send queue; the next page is not held up meanwhile
+                start_delivery(user_id, mode, [(sr, i)], alert)
             else:
-                notification = f"user {user_id} - {raw_result}"
-                await update.message.reply_text(redacted(raw_result))
-                await notifyer.log_and_notify_admin(notification, once=True)
-                break
-    shuffle(results)
-    return results
+                packed.append((sr, i))
+
+    if packed:
+        start_delivery(user_id, mode, packed, alert)
+
+    for search_num, (found, new) in polled.items():
+        if search_num in answered and user_data.get(search_num):
+            adapt_poll_interval(user_id, user_data, search_num, found, new)
+    if answered:  # watermarks, yields and intervals changed
+        application.mark_data_for_update_persistence(user_ids=int(user_id))
+        # subscribed and polled: active, even when nothing new came
+        mark_active(application.bot_data, user_id)
+
+
+def start_delivery(user_id: str, mode: str, items: list, alert):
+    task = asyncio.ensure_future(deliver(user_id, mode, items, alert))
+    sending.add(task)
+    task.add_done_callback(sending.discard)
+
+
+async def deliver(user_id: str, mode: str, items: list, alert):
+    """items: (ItemSummary, text) sent the way the user chose"""
+    send = SENDERS.get(mode, SENDERS["items"])
+    try:
+        delivered = await send(
+            application.bot, user_id, items, rate_limit_args=PRIORITY_FEED
+        )
+    except Exception as e:
+        logger.error(
+            f"Error in sending {len(items)} items to user {user_id}: {redacted(str(e))}"
+        )
+        return
+    if alert:
+        for sr in delivered:
+            if sr.bid_price:
+                ending_alerts.add(user_id, sr, sr.end_timestamp, alert["minutes"])
+
+
+def adapt_poll_interval(user_id, user_data, search_num, found, new):
+    # yield: new items per what the poll could bring; only polls eBay answered
+    pages = search_page_budget(user_data[search_num])
+    try:
+        capacity = max(found, int(user_data[search_num].get("limit", 50)) * pages)
+    except ValueError:
+        capacity = max(found, 50 * pages)
+    poll_yield = new / capacity if capacity else 0
+
+    meta = search_meta(user_data, search_num)
+    meta["yield"] = (
+        POLL_YIELD_SMOOTHING * poll_yield
+        + (1 - POLL_YIELD_SMOOTHING) * meta.get("yield", TARGET_POLL_YIELD)
+    )
+    meta["interval"] = mailing_scheduler.adapted_interval(
+        meta.get("interval", QUEUE_TIME_INERVAL), meta["yield"]
+    )
+    meta["interval"] = min(max(meta["interval"], MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+    mailing_scheduler.set_interval(user_id, search_num, meta["interval"], pages)
+
+
+mailing_scheduler.job = mailing
+
+
+async def alert_ending_soon(user_id: str, item_id: int, end_date: str, bid_price):
+    """ENDING ALERTS JOB: an auction the user was sent is about to end"""
+    user_data = application.user_data.get(int(user_id))
+    if not user_data or user_data.get("status") != "on":
+        return
+    alert = user_data.get("ending_alert")
+    if not alert:
+        return  # opted out meanwhile
+
+    if alert.get("fresh_price"):
+        # the only eBay call of an alert, and only on request
+        mailing_scheduler.charge()
+        item = await get_ebay_item(item_id)
+        if type(item) != str:
+            if not item.bid_price:
+                return  # sold or turned into a fixed price listing
+            end_date, bid_price = item.end_date or end_date, item.bid_price
+
+    await application.bot.send_message(
+        chat_id=user_id,
+        text=textify_ending_alert(item_id, end_date, bid_price),
+        parse_mode="MarkDownV2",
+        rate_limit_args=PRIORITY_FEED,
+    )
+
+
+ending_alerts.job = alert_ending_soon
+
+
+async def call_ebay(
+    user_id: str, user_data: dict, search_nums: list, seen, answered: set
+):
+    """yields (search_num, result page) of the user searches as they arrive;
+    answered gets the search_nums polled without an error"""
+    if ebay_call_counter.value <= 0:
+        await notifyer.log_and_notify_admin(
+            "Exceeded amount of the allowed eBay API calls.", once=True
+        )
+        return
+
+    pages = asyncio.Queue()  # (search_num, page); None: one of the searches is over
+    errors = []
+    searches = [
+        asyncio.ensure_future(
+            poll_search(user_data, search_num, seen, pages, errors, answered)
+        )
+        for search_num in search_nums
+        if user_data.get(search_num)  # deleted since it was scheduled
+    ]
+    try:
+        remaining = len(searches)
+        while remaining:
+            page = await pages.get()
+            if page is None:
+                remaining -= 1
+                continue
+            yield page
+    finally:
+        for search in searches:
+            search.cancel()
+
+    # one report per cycle
+    if errors:
+        text = "\n".join(errors)
+        await application.bot.send_message(chat_id=user_id, text=redacted(text))
+        await notifyer.log_and_notify_admin(f"user {user_id} - {text}", once=True)
+
+
+async def poll_search(user_data, search_num, seen, pages, errors, answered):
+    meta = search_meta(user_data, search_num)
+    search = dict(user_data[search_num])
+    polled_at = datetime.now(timezone.utc)
+    found = []
+    cursor = {}
+    try:
+        async with ebay_search_semaphore:
+            async with asyncio.timeout(EBAY_SEARCH_TIMEOUT):
+                async for page in iter_ebay_search(
+                    search,
+                    since=meta.get("watermark"),
+                    seen=seen,
+                    offset=meta.get("read_on", 0),
+                    cursor=cursor,
+                ):
+                    found += page
+                    pages.put_nowait((search_num, list(page)))
+    except EbaySearchError as e:
+        errors.append(f"№{search_num}: {e}")
+    except TimeoutError:
+        errors.append(f"№{search_num}: Error occurred: eBay did not answer in time")
+    except Exception as e:
+        logger.error(f"Error in search {search_num}: {redacted(str(e))}")
+        errors.append(f"№{search_num}: Error occurred: {e}")
+    else:
+        answered.add(search_num)
+        if search.get("sort") == "newlyListed":
+            read_on = meta.pop("read_on", None)
+            if cursor.get("next_offset"):
+                # more listings since the watermark than the page budget (downtime):
+                # it stays, the next polls read on down to it
+                meta["read_on"] = cursor["next_offset"]
+            elif found or not read_on:
+                # after reading on only up to the backlog: what came meanwhile is newer
+                meta["watermark"] = advance_watermark(
+                    meta.get("watermark"), found, polled_at
+                )
+    finally:
+        pages.put_nowait(None)
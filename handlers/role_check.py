@@ -1,5 +1,5 @@
 from telegram import Update
-from telegram.ext import CallbackContext
+from telegram.ext import ApplicationHandlerStop, CallbackContext
 
 import asyncio
 import functools
@@ -7,31 +7,72 @@ import functools
 from logs.mylogging import logger, redacted
 from settings.settings import ADMIN_GROUP
 from settings.background_objects import notifyer
+from utils.active_users import active_users, mark_active
+from utils.ban_index import ban_index
+
+
+# --------------------------------------ROLES--------------------------------------------
+def memoized_role(role_checker):
+    # the context lives as long as the update: a role is resolved once,
+    # nested handlers (pause inside add) read context.roles
+    @functools.wraps(role_checker)
+    def wrapper(update: Update, context: CallbackContext):
+        roles = getattr(context, "roles", None)
+        if roles is None:
+            roles = context.roles = {}
+        role = role_checker.__name__
+        if role not in roles:
+            roles[role] = bool(role_checker(update, context))
+        return roles[role]
+
+    return wrapper
+
+
+def forget_roles(context: CallbackContext):
+    # after a write to the status, the active users or the ban index:
+    # later checks of the same update resolve the roles again
+    context.roles = {}
 
 
 # --------------------------------------CHECKERS--------------------------------------------
+@memoized_role
 def is_user_admin(update: Update, context: CallbackContext):
-    sender_id = str(update.message.from_user.id)
+    sender_id = str(update.effective_user.id)
     return sender_id in ADMIN_GROUP
 
 
+@memoized_role
 def is_registered_user(update: Update, context: CallbackContext):
     return context.user_data.get("status")
 
 
+@memoized_role
 def is_active_user(update: Update, context: CallbackContext):
-    sender_id = str(update.message.from_user.id)
-    return context.bot_data.get("cache", {}).get(sender_id)
+    sender_id = str(update.effective_user.id)
+    return sender_id in active_users(context.bot_data)
 
 
+@memoized_role
 def is_allowed_user(update: Update, context: CallbackContext):
     # bot check
-    if update.message.from_user.is_bot:
+    if update.effective_user.is_bot:
         return False
 
     # ban check
-    sender_id = str(update.message.from_user.id)
-    return sender_id not in context.bot_data.get("banned_users", [])
+    sender_id = str(update.effective_user.id)
+    return sender_id not in ban_index.banned(context.bot_data)
+
+
+# --------------------------------------MIDDLEWARE--------------------------------------------
+async def authorize(update: Update, context: CallbackContext):
+    """TypeHandler in group -1: runs before every other handler, once per update"""
+    if update.effective_user is None:  # channel posts, polls: no sender to check
+        return
+    if not is_allowed_user(update, context):
+        raise ApplicationHandlerStop  # banned users and bots reach no handler
+    if context.user_data.get("status"):  # registered: a command keeps the slot
+        is_active_user(update, context)  # resolved as it was before this command
+        mark_active(context.bot_data, str(update.effective_user.id))
 
 
 # -------------------------------------DECORATOR--------------------------------------------
@@ -5,6 +5,8 @@ from telegram.error import TelegramError
 from logs.mylogging import logger
 from settings import settings
 from settings import background_objects
+from utils.active_users import active_users
+from utils.broadcast import broadcast, summary
 
 from handlers.user import pause
 from handlers.role_check import (
@@ -36,12 +38,8 @@ async def log_and_reply(update, text, parse_mode=None):
 
 
 async def send_photo_to_users(context, photo_id, text, user_ids):
-    """Sends photo to a list of user IDs."""
-    for user_id in user_ids:
-        try:
-            await context.bot.send_photo(chat_id=user_id, caption=text, photo=photo_id)
-        except TelegramError as e:
-            logger.error(f"Error in sending photo to user {user_id}: {e}")
+    """Sends photo to a list of user IDs; returns the broadcast report."""
+    return await broadcast(context.bot, user_ids, text=text, photo_id=photo_id)
 
 
 # ----------------------------------------------------COMMANDS--------------------------------------------------
@@ -59,7 +57,9 @@ async def support(update: Update, context: CallbackContext):
 
     if text:
         await pause(update, context)
-        await background_objects.notifyer.send(text=full_text, once=True)
+        await background_objects.notifyer.send(
+            text=full_text, once=True, fingerprint=full_text
+        )
         await log_and_reply(update, REQUEST_SUBMITTED_REPLY, parse_mode="MarkDownV2")
 
 
@@ -76,17 +76,26 @@ async def photo_handler(update: Update, context: CallbackContext):
         if caption:
             if MAIL_ALL_USERS_COMMAND in caption:
                 text = caption.replace(MAIL_ALL_USERS_COMMAND, "").strip()
-                active_users = context.bot_data.get("cache", {}).keys()
-                await send_photo_to_users(context, photo_id, text, active_users)
-                await log_and_reply(update, ADMIN_NOTIFICATION.format("all", text))
+                recipients = list(active_users(context.bot_data).keys())
+                report = await send_photo_to_users(
+                    context, photo_id, text, recipients
+                )
+                await log_and_reply(
+                    update,
+                    ADMIN_NOTIFICATION.format("all", text) + f"\n\n{summary(report)}",
+                )
 
             elif MAIL_USER_COMMAND in caption:
                 lines = caption.split("\n")
                 target_user_id = lines[0].replace(MAIL_USER_COMMAND, "").strip()
                 text = "\n".join(lines[1:])
-                await send_photo_to_users(context, photo_id, text, [target_user_id])
+                report = await send_photo_to_users(
+                    context, photo_id, text, [target_user_id]
+                )
                 await log_and_reply(
-                    update, ADMIN_NOTIFICATION.format(target_user_id, text)
+                    update,
+                    ADMIN_NOTIFICATION.format(target_user_id, text)
+                    + f"\n\n{summary(report)}",
                 )
 
     if caption and SUPPORT_COMMAND in caption:
@@ -98,7 +107,7 @@ async def photo_handler(update: Update, context: CallbackContext):
         full_text = SUPPORT_REQUEST.format(sender_id, text)
         await pause(update, context)
         await background_objects.notifyer.send(
-            photo_id=photo_id, text=full_text, once=True
+            photo_id=photo_id, text=full_text, once=True, fingerprint=photo_id
         )
         await log_and_reply(update, REQUEST_SUBMITTED_REPLY, parse_mode="MarkDownV2")
 
@@ -10,6 +10,8 @@ from settings.settings import (
     MAX_SEARCHES_AMOUNT,
     DEFAULT_CALL_PARAMS,
     DEFAULT_CALL_PARAMS2,
+    ENDING_ALERT_MINUTES,
+    MAX_ENDING_ALERT_MINUTES,
 )
 
 from utils.helpers import (
@@ -18,14 +20,19 @@ from utils.helpers import (
     params_to_template,
     next_available_search_num,
     extract_digit_from_command,
+    drop_search_meta,
 )
 
 from handlers.role_check import (
     check_role_decorator,
+    forget_roles,
     is_allowed_user,
     is_registered_user,
 )
 from handlers.mailing import start_mailing_task, stop_mailing_task
+from utils.active_users import active_users
+from utils.delivery import DELIVERY_MODES
+from settings.background_objects import ending_alerts
 
 
 # ----------------------------------ERROR HANDLING------------------------------------
@@ -51,6 +58,7 @@ async def start(update: Update, context: CallbackContext):
     elif status == "off":
         start_mailing_task(update, context)
         user_data["status"] = "on"
+        forget_roles(context)
         await update.message.reply_text("🍑 Posting resumed... ")
 
 
@@ -60,6 +68,7 @@ async def pause(update: Update, context: CallbackContext):
     if status == "on":
         stop_mailing_task(update, context)
         context.user_data["status"] = "off"
+        forget_roles(context)
         await update.message.reply_text(
             "🍑 Posting paused... \n\nto continue /start\nto /help "
         )
@@ -79,7 +88,7 @@ def get_user_full_info(user) -> dict:
 
 
 async def handle_new_user(update: Update, context: CallbackContext):
-    if len(context.bot_data.get("cache", {})) >= MAX_USERS_AMOUNT:
+    if len(active_users(context.bot_data)) >= MAX_USERS_AMOUNT:
         await update.message.reply_text("Too many users! Sorry :(")
         return
 
@@ -87,6 +96,7 @@ async def handle_new_user(update: Update, context: CallbackContext):
     user_data["info"] = get_user_full_info(update.effective_user)
     user_data["1"] = DEFAULT_CALL_PARAMS
     user_data["status"] = "on"
+    forget_roles(context)
 
     await send_welcome_message(update)
     start_mailing_task(update, context)
@@ -124,6 +134,7 @@ async def save_search(
             await update.message.reply_text(f"This search already exists")
             return
         context.user_data[new_search_num] = params
+        drop_search_meta(context.user_data, new_search_num)
         await update.message.reply_text(
             f"🍑 Successfully added\! \n\n№ *{new_search_num}*\n{escape_markdown_v2(params_to_template(params))}\n\n/searches\n/start",
             parse_mode="MarkDownV2",
@@ -169,6 +180,7 @@ async def delete(update: Update, context: CallbackContext):
         return
 
     search = context.user_data.pop(search_num)
+    drop_search_meta(context.user_data, search_num)
     await update.message.reply_text(
         f"🍑 № *{search_num}* successfully deleted\!\n\n/searches\n/start",
         parse_mode="MarkDownV2",
@@ -202,6 +214,48 @@ async def template(update: Update, context: CallbackContext):
     await update.message.reply_text(TEXT, parse_mode='MarkDownV2')
 
 
+@check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_registered_user])
+async def alerts(update: Update, context: CallbackContext):
+    # /alerts [minutes] [price] | /alerts off
+    words = update.message.text.lower().split()[1:]
+    user_id = str(update.message.from_user.id)
+
+    if "off" in words:
+        context.user_data.pop("ending_alert", None)
+        ending_alerts.drop_user(user_id)
+        await update.message.reply_text("⏰ Ending soon alerts are off.")
+        return
+
+    minutes = extract_digit_from_command(" ".join(words)) or ENDING_ALERT_MINUTES
+    minutes = min(minutes, MAX_ENDING_ALERT_MINUTES)
+    context.user_data["ending_alert"] = {
+        "minutes": minutes,
+        "fresh_price": "price" in words,
+    }
+    await update.message.reply_text(
+        f"⏰ Auctions you get from now on will be reminded {minutes} minutes before they end"
+        + (", with a fresh price." if "price" in words else ".")
+        + "\n\nto stop /alerts off"
+    )
+
+
+@check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_registered_user])
+async def delivery(update: Update, context: CallbackContext):
+    # /delivery items | digest | album
+    words = update.message.text.lower().split()[1:]
+    mode = words[0] if words else None
+    if mode not in DELIVERY_MODES:
+        current = context.user_data.get("delivery", "items")
+        modes = "\n".join(f"{k} - {v}" for k, v in DELIVERY_MODES.items())
+        await update.message.reply_text(
+            f"📬 Now: {current}\n\n{modes}\n\nto change /delivery digest"
+        )
+        return
+
+    context.user_data["delivery"] = mode
+    await update.message.reply_text(f"📬 From now on: {DELIVERY_MODES[mode]}.")
+
+
 @check_role_decorator(allowed_role_checker_list=[is_allowed_user, is_registered_user])
 async def help(update: Update, context: CallbackContext):
     await pause(update, context)
@@ -218,6 +272,11 @@ async def help(update: Update, context: CallbackContext):
                     \- add a search
         /delete \__number of the search_\_ 
                     \- delete a search
+        /alerts \__minutes_\_ 
+                    \- a reminder before the auctions you got end; add _price_ for a fresh bid
+        /alerts off \- no reminders
+        /delivery \__items_, _digest_ or _album_\_ 
+                    \- one message per item, a few long messages or photo albums
         /support \__your request here_\_ 
                     \- leave feedback and/or report a problem; 
                     \- accepts pictures \(the command has to be in the caption\);  
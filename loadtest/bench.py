@@ -0,0 +1,334 @@
+"""MICROBENCHMARKS OF THE PER-ITEM HOT PATH ON RECORDED BROWSE PAYLOADS
+
+python -m loadtest.bench --out bench.json
+python -m loadtest.bench --quick --only escape_markdown_v2,time_left
+
+Every item the bot delivers goes through these functions. Results are written as
+json, one record per case, so runs before and after a change can be diffed.
+"""
+import argparse
+import copy
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+import timeit
+
+
+PAYLOAD = os.path.join(os.path.dirname(__file__), "payloads", "browse_search.json")
+BATCH_SIZES = [1, 10, 50, 200]
+CACHE_FILLS = [0, 0.5, 1]  # share of MAX_CACHE_LEN already seen by the user
+DATE_FIELDS = ["itemEndDate", "itemCreationDate", "itemOriginDate"]
+
+# the modules read their settings on import
+os.environ.setdefault("TG_BOT_TOKEN", "123456:BENCH")
+
+
+# ---------------------------------------------------PAYLOADS-------------------------------------------------------
+def load_payload(path=PAYLOAD) -> dict:
+    """the recorded answer, its dates moved as if it was recorded just now"""
+    with open(path) as f:
+        payload = json.load(f)
+    recorded_at = datetime.fromisoformat(payload.pop("recordedAt").replace("Z", "+00:00"))
+    shift = datetime.now(timezone.utc) - recorded_at
+    for sr in payload["itemSummaries"]:
+        for field in DATE_FIELDS:
+            try:
+                date = datetime.fromisoformat(sr[field].replace("Z", "+00:00"))
+            except (KeyError, ValueError):
+                continue
+            # kept in its own format: the malformed ones stay malformed
+            sr[field] = (date + shift).isoformat(timespec="milliseconds")
+            sr[field] = sr[field].replace("+00:00", "Z")
+    return payload
+
+
+def item_dicts(payload: dict, amount: int, first_id: int = 0) -> list:
+    """amount of items cycling over the recorded ones, each with its own id"""
+    recorded = payload["itemSummaries"]
+    items = []
+    for i in range(amount):
+        sr = copy.deepcopy(recorded[i % len(recorded)])
+        if sr.get("legacyItemId"):
+            sr["legacyItemId"] = str(int(sr["legacyItemId"]) + first_id + i)
+        items.append(sr)
+    return items
+
+
+# ---------------------------------------------------TIMING---------------------------------------------------------
+class Bench:
+    def __init__(self, repeat: int, min_time: float):
+        self.repeat = repeat  # measurements per case; the median is reported
+        self.min_time = min_time  # IN SECONDS, per measurement
+        self.results = []
+
+    def record(self, name, case: dict, per_call: list, items: int, skipped=0):
+        median = statistics.median(per_call)
+        self.results.append(
+            {
+                "name": name,
+                **case,
+                "items": items,
+                "skipped_inputs": skipped,  # raise on their own; kept out of the timing
+                "ns_per_call": median * 1e9,
+                "ns_per_call_min": min(per_call) * 1e9,
+                "ns_per_item": median * 1e9 / items if items else None,
+                "calls_per_second": 1 / median if median else None,
+            }
+        )
+        print(
+            f"{name:<32} {json.dumps(case):<40} {median * 1e6:>12.2f} us/call"
+            f"{'' if items <= 1 else f'  {median * 1e9 / items:>10.0f} ns/item'}"
+            f"{f'  ({skipped} inputs raise)' if skipped else ''}"
+        )
+
+    def loop(self, name, case: dict, func, items=1, skipped=0):
+        """stateless calls: timeit loops"""
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        number = max(1, int(number * self.min_time / max(elapsed, 1e-9)))
+        per_call = [t / number for t in timer.repeat(self.repeat, number)]
+        self.record(name, case, per_call, items, skipped)
+
+    def rounds(self, name, case: dict, setup, func, items=1, skipped=0):
+        """calls that change their state: a fresh setup, untimed, before each call"""
+        per_call = []
+        for _ in range(self.repeat):
+            total = calls = 0
+            while total < self.min_time or calls < 3:
+                state = setup()
+                started = time.perf_counter()
+                func(state)
+                total += time.perf_counter() - started
+                calls += 1
+            per_call.append(total / calls)
+        self.record(name, case, per_call, items, skipped)
+
+
+def raises(func, *args) -> bool:
+    try:
+        func(*args)
+        return False
+    except Exception:
+        return True
+
+
+# ---------------------------------------------------CASES----------------------------------------------------------
+def bench_escape(bench, payload):
+    from utils.helpers import escape_markdown_v2
+
+    texts = {
+        "price": "410.00",
+        "link": "https://www.ebay.com/itm/266712345678",
+        "title": payload["itemSummaries"][2]["title"],
+        "clean": "vintage compressor",
+    }
+    for kind, text in texts.items():
+        bench.loop("escape_markdown_v2", {"text": kind}, lambda: escape_markdown_v2(text))
+
+
+AUCTION_ENDS = {  # days ahead: the first unit fits, minutes ahead: all three are tried
+    "days": timedelta(days=3),
+    "hours": timedelta(hours=5),
+    "minutes": timedelta(minutes=20),
+}
+
+
+def bench_time_left(bench, payload):
+    from utils.rendering import time_left
+
+    time_now = time.time()
+    for left, ahead in AUCTION_ENDS.items():
+        end_timestamp = int(time_now + ahead.total_seconds())
+        bench.loop(
+            "time_left", {"ends_in": left}, lambda: time_left(end_timestamp, time_now)
+        )
+
+
+def bench_render_auction(bench, payload):
+    from ebay.ebay_item import ItemSummary
+    from utils.rendering import render_item
+
+    # the body is cached by time bucket: after the first call these are cache hits
+    sr = dict(payload["itemSummaries"][0], currentBidPrice={"value": "410.00", "currency": "USD"})
+    time_now = datetime.now(timezone.utc)
+    for left, ahead in AUCTION_ENDS.items():
+        sr["itemEndDate"] = (time_now + ahead).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        item = ItemSummary.from_dict(sr)
+        bench.loop("render_item", {"ends_in": left}, lambda: render_item(item))
+
+
+def bench_textify_search_item(bench, payload):
+    from ebay.ebay_item import ItemSummary
+    from utils.helpers import textify_search_item
+
+    kinds = {"auction": [], "fixed_price": [], "malformed": []}
+    for sr in payload["itemSummaries"]:
+        item = ItemSummary.from_dict(sr)
+        if "malformed" in (sr.get("title") or ""):
+            kinds["malformed"].append(item)
+        elif item.bid_price:
+            kinds["auction"].append(item)
+        else:
+            kinds["fixed_price"].append(item)
+
+    for kind, items in kinds.items():
+        usable = [item for item in items if not raises(textify_search_item, item)]
+        skipped = len(items) - len(usable)
+        if not usable:
+            bench.record("textify_search_item", {"kind": kind}, [0], 0, skipped)
+            continue
+        bench.loop(
+            "textify_search_item",
+            {"kind": kind},
+            lambda: [textify_search_item(item) for item in usable],
+            items=len(usable),
+            skipped=skipped,
+        )
+
+
+def bench_parse(bench, payload):
+    from ebay.ebay_item import ItemSummary
+    from ebay.ebay_call import parse_ebay_search_output
+    from ebay.seen_items import SeenItems
+    from settings.settings import MAX_CACHE_LEN, SEEN_ITEM_END_GRACE
+    from utils.helpers import textify_search_item
+
+    for fill in CACHE_FILLS:
+        seen = SeenItems(MAX_CACHE_LEN, SEEN_ITEM_END_GRACE)
+        for i in range(int(MAX_CACHE_LEN * fill)):
+            seen.add(10**11 + i, int(time.time()) + 86400)
+        stored = seen.to_bytes()
+
+        for size in BATCH_SIZES:
+            items = [ItemSummary.from_dict(sr) for sr in item_dicts(payload, size)]
+            usable = [item for item in items if not raises(textify_search_item, item)]
+
+            def setup():
+                # loaded as the mailing has it, with the journal of the seen store
+                seen = SeenItems.from_bytes(stored, MAX_CACHE_LEN, SEEN_ITEM_END_GRACE)
+                return seen, []
+
+            bench.rounds(
+                "parse_ebay_search_output",
+                {"batch": size, "cache_fill": fill},
+                setup,
+                lambda state: list(parse_ebay_search_output(usable, *state)),
+                items=len(usable),
+                skipped=size - len(usable),
+            )
+
+
+def bench_decode(bench, payload):
+    from ebay.ebay_item import ItemSummary
+    from utils.json_backend import loads, JSON_BACKEND
+
+    for size in BATCH_SIZES:
+        body = json.dumps(dict(payload, itemSummaries=item_dicts(payload, size))).encode()
+        bench.loop(
+            "decode_search_page",
+            {"batch": size, "backend": JSON_BACKEND},
+            lambda: [ItemSummary.from_dict(sr) for sr in loads(body)["itemSummaries"]],
+            items=size,
+        )
+
+
+def bench_params(bench, payload):
+    from ebay.ebay_call import user_data_params_to_actual
+    from settings.settings import DEFAULT_CALL_PARAMS, DEFAULT_CALL_PARAMS2
+
+    searches = {
+        "defaults": {"q": "vintage compressor"},
+        "full": dict(DEFAULT_CALL_PARAMS2),
+        "custom_filter": dict(
+            DEFAULT_CALL_PARAMS, filter="price:[10..300],priceCurrency:USD"
+        ),
+    }
+    for kind, params in searches.items():
+        bench.loop(
+            "user_data_params_to_actual",
+            {"search": kind},
+            lambda: user_data_params_to_actual(dict(params)),
+        )
+
+
+def bench_redacted(bench, payload):
+    from logs.mylogging import redacted
+
+    messages = {
+        "short": "Error in search 2: Error occurred: daily eBay API calls limit reached",
+        "url": "Cannot connect to host https://api.telegram.org/bot123456:ABC-def/sendMessage ssl:default",
+        "long": "Error occurred: " + json.dumps(payload["itemSummaries"][0]),
+    }
+    for kind, message in messages.items():
+        bench.loop("redacted", {"message": kind}, lambda: redacted(message))
+
+
+CASES = {
+    "escape_markdown_v2": bench_escape,
+    "time_left": bench_time_left,
+    "render_item": bench_render_auction,
+    "textify_search_item": bench_textify_search_item,
+    "parse_ebay_search_output": bench_parse,
+    "decode_search_page": bench_decode,
+    "user_data_params_to_actual": bench_params,
+    "redacted": bench_redacted,
+}
+
+
+# ---------------------------------------------------RUN IT---------------------------------------------------------
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-item hot path benchmarks")
+    parser.add_argument("--out", help="json results file")
+    parser.add_argument("--only", help="comma separated cases: " + ",".join(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds")
+    parser.add_argument("--quick", action="store_true", help="repeat 3, min time 0.05")
+    parser.add_argument(
+        "--with-logs", action="store_true", help="time the INFO logging as well"
+    )
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.min_time = 3, 0.05
+
+    payload = load_payload()
+    import logs.mylogging  # noqa: configures logging
+
+    if not args.with_logs:
+        logging.disable(logging.INFO)
+
+    bench = Bench(args.repeat, args.min_time)
+    names = args.only.split(",") if args.only else list(CASES)
+    for name in names:
+        CASES[name](bench, payload)
+
+    results = {
+        "revision": git_revision(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "min_time": args.min_time,
+        "with_logs": args.with_logs,
+        "results": bench.results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
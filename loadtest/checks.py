@@ -0,0 +1,196 @@
+"""DELIVERY AND EBAY FAILURE CHECKS, AGAINST FAKE SERVERS
+
+python -m loadtest.checks
+
+A batch with malformed items (no price, no id) goes through the parsing and every
+delivery mode; all the items that can be rendered must reach the chat. Then eBay
+answers a 502 html page and resets a connection: the calls must come back with
+the error string, not raise. Last, one update registers a user and then erases
+them: the role checks must follow. Exits non-zero if any check fails.
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+from types import SimpleNamespace
+
+from loadtest import fake_telegram
+from loadtest.bench import load_payload, item_dicts
+from loadtest.faults import Faults, serve
+
+HOST, PORT = "127.0.0.1", 8083
+EBAY_PORT = 8084
+BATCH = 30
+
+# the modules read their settings on import
+os.environ.setdefault("TG_BOT_TOKEN", "123456:CHECKS")
+os.environ.setdefault("EBAY_API_URL", f"http://{HOST}:{EBAY_PORT}")
+
+
+def malformed_batch(payload: dict) -> list:
+    """BATCH items, one of them stripped of its price like a broken listing"""
+    items = item_dicts(payload, BATCH, first_id=10**6)
+    items[BATCH // 2].pop("price", None)
+    items[BATCH // 2].pop("currentBidPrice", None)
+    return items
+
+
+async def check_delivery_modes(payload: dict) -> list:
+    from telegram import Bot
+    from ebay.ebay_item import ItemSummary
+    from ebay.ebay_call import parse_ebay_search_output
+    from ebay.seen_items import SeenItems
+    from settings.settings import MAX_CACHE_LEN, SEEN_ITEM_END_GRACE
+    from utils.delivery import SENDERS
+    from utils.helpers import textify_search_item
+
+    results = [ItemSummary.from_dict(sr) for sr in malformed_batch(payload)]
+    expected = {
+        sr.item_id
+        for sr in results
+        if sr.item_id is not None and textify_search_item(sr) is not None
+    }
+
+    fake = fake_telegram.FakeTelegram(Faults(latency=0, jitter=0), chat_interval=0)
+    received = {}  # chat id: item ids
+    fake.on_delivery = lambda chat_id, item_id, _: received.setdefault(chat_id, set()).add(item_id)
+    runner = await serve(fake.app, HOST, PORT)
+    bot = Bot("123456:CHECKS", base_url=f"http://{HOST}:{PORT}/bot")
+    failures = []
+    try:
+        await bot.initialize()
+        for chat_id, mode in enumerate(SENDERS, start=1):
+            seen = SeenItems(MAX_CACHE_LEN, SEEN_ITEM_END_GRACE)
+            items = list(parse_ebay_search_output(results, seen))
+            delivered = await SENDERS[mode](bot, chat_id, items)
+            lost = expected - received.get(str(chat_id), set())
+            if lost or {sr.item_id for sr in delivered} != expected:
+                failures.append(f"{mode}: {len(lost)} of {len(expected)} items lost")
+            print(f"{mode}: {len(delivered)} of {len(expected)} items delivered")
+    finally:
+        await bot.shutdown()
+        await runner.cleanup()
+    return failures
+
+
+# ---------------------------------------------------BROKEN EBAY----------------------------------------------------
+BAD_GATEWAY = (
+    b"HTTP/1.1 502 Bad Gateway\r\nContent-Type: text/html\r\nContent-Length: 50\r\n\r\n"
+    b"<html><body><h1>502 Bad Gateway</h1></body></html>"
+)
+
+
+async def broken_ebay(reader, writer):
+    """tokens are fine; searches get a gateway html page, item lookups a reset"""
+    request = await reader.readuntil(b"\r\n\r\n")
+    if b"/oauth2/token" in request.split(b"\r\n")[0]:
+        body = json.dumps({"access_token": "checks", "expires_in": 7200}).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    elif b"/item_summary/search" in request.split(b"\r\n")[0]:
+        writer.write(BAD_GATEWAY)
+        await writer.drain()
+    else:  # linger 0: the close sends a RST
+        sock = writer.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    writer.close()
+
+
+async def check_ebay_failures() -> list:
+    from ebay.ebay_call import get_ebay_item, get_ebay_search_result
+    from settings.background_objects import ebay_client
+
+    server = await asyncio.start_server(broken_ebay, HOST, EBAY_PORT)
+    failures = []
+    calls = {
+        "502 html page": lambda: get_ebay_search_result({"q": "vintage compressor"}),
+        "connection reset": lambda: get_ebay_item(266712345678),
+    }
+    try:
+        for name, call in calls.items():
+            try:
+                result = await call()
+            except Exception as e:
+                failures.append(f"{name}: raised {type(e).__name__} {e}")
+                continue
+            if type(result) != str or not result.startswith("Error occurred"):
+                failures.append(f"{name}: returned {result!r}")
+            print(f"{name}: {result}")
+    finally:
+        await ebay_client.close()
+        server.close()
+        await server.wait_closed()
+    return failures
+
+
+# ---------------------------------------------------ROLES-----------------------------------------------------------
+class UpdateContext:
+    """the parts of a CallbackContext the handlers read; user_data as the app has it"""
+
+    def __init__(self, application, user_id: int):
+        self.application = application
+        self.user_id = user_id
+        self.bot_data = application.bot_data
+
+    @property
+    def user_data(self):
+        return self.application.user_data[self.user_id]  # a defaultdict underneath
+
+
+async def check_roles_within_update() -> list:
+    from handlers.data_erasure import confirm_delete, start_delete
+    from handlers.role_check import is_registered_user
+    from handlers.user import start
+    from settings.background_objects import mailing_scheduler
+    from settings.app import application
+
+    async def reply_text(*args, **kwargs):
+        pass
+
+    user = SimpleNamespace(id=10**9, is_bot=False, username="checks", first_name="Checks",
+                           last_name=None, language_code="en")
+    message = SimpleNamespace(from_user=user, text="/start", reply_text=reply_text)
+    update = SimpleNamespace(effective_user=user, message=message)
+    context = UpdateContext(application, user.id)  # one update: the roles are shared
+
+    failures = []
+    steps = [
+        ("new user", None, False),
+        ("/start", start, True),
+        ("/forget_me", start_delete, True),  # paused, still registered
+        ("yes", confirm_delete, False),
+    ]
+    try:
+        for name, handler, registered in steps:
+            message.text = name
+            if handler:
+                await handler(update, context)
+            if bool(is_registered_user(update, context)) != registered:
+                failures.append(f"roles: after {name} registered is not {registered}")
+            print(f"roles: after {name} registered {bool(is_registered_user(update, context))}")
+    finally:
+        mailing_scheduler.unschedule_user(str(user.id))
+        application.drop_user_data(user.id)
+    return failures
+
+
+def main():
+    payload = load_payload()
+    import logs.mylogging  # noqa: configures logging
+
+    failures = asyncio.run(check_delivery_modes(payload))
+    failures += asyncio.run(check_ebay_failures())
+    failures += asyncio.run(check_roles_within_update())
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""A STAND-IN FOR THE EBAY BROWSE API AND ITS OAUTH ENDPOINT
+
+python -m loadtest.fake_ebay --port 8081 --items-per-minute 120
+then EBAY_API_URL=http://127.0.0.1:8081 for the bot
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import hashlib
+import random
+import re
+import secrets
+import time
+
+from aiohttp import web
+
+from loadtest.faults import Faults, serve
+
+
+EBAY_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+START_DATE_FILTER = re.compile(r"itemStartDate:\[([^\].]+)\.\.")
+BUYING_OPTIONS_FILTER = re.compile(r"buyingOptions:\{([^}]*)\}")
+
+
+# ---------------------------------------------------SYNTHETIC ITEMS-----------------------------------------------
+class ItemStream:
+    """LISTINGS APPEARING AT A STEADY RATE; EVERY QUERY MATCHES ITS OWN SHARE OF THEM"""
+
+    def __init__(
+        self,
+        items_per_minute=60,
+        auction_share=0.5,
+        malformed_share=0.01,
+        match_share=0.3,
+        max_items=20000,
+        backlog=500,
+        seed=None,
+    ):
+        self.interval = 60 / items_per_minute  # IN SECONDS, between two listings
+        self.auction_share = auction_share
+        self.malformed_share = malformed_share  # no id, no price or a broken date
+        self.match_share = match_share  # of all listings, per query
+        self.max_items = max_items  # the oldest are forgotten
+        self.random = random.Random(seed)
+        self.items = []  # oldest first
+        self.listed = {}  # legacy item id: listed at, epoch
+        self.next_id = 110000000000
+        # listed before the start: the first polls are not empty
+        self.next_at = time.time() - backlog * self.interval
+
+    def catch_up(self):
+        time_now = time.time()
+        while self.next_at <= time_now:
+            self.items.append(self.new_item(self.next_at))
+            self.listed[self.next_id] = self.next_at
+            self.next_at += self.interval
+        if len(self.items) > self.max_items:
+            for item in self.items[: len(self.items) - self.max_items]:
+                self.listed.pop(int(item["itemId"].split("|")[1]), None)
+            del self.items[: len(self.items) - self.max_items]
+
+    def new_item(self, listed_at: float) -> dict:
+        self.next_id += self.random.randint(1, 50)
+        auction = self.random.random() < self.auction_share
+        created = datetime.fromtimestamp(listed_at, timezone.utc)
+        lasts = timedelta(
+            minutes=self.random.randint(60, 7 * 24 * 60) if auction else 30 * 24 * 60
+        )
+        price = {"value": f"{self.random.uniform(1, 500):.2f}", "currency": "USD"}
+        item = {
+            "itemId": f"v1|{self.next_id}|0",
+            "legacyItemId": str(self.next_id),
+            "title": f"Vintage thing {self.next_id}",
+            "price": price,
+            "buyingOptions": ["AUCTION"] if auction else ["FIXED_PRICE", "BEST_OFFER"],
+            "itemCreationDate": created.strftime(EBAY_DATE_FORMAT),
+            "itemEndDate": (created + lasts).strftime(EBAY_DATE_FORMAT),
+            "image": {"imageUrl": f"https://i.ebayimg.com/images/g/{self.next_id}/s-l225.jpg"},
+            "itemWebUrl": f"https://www.ebay.com/itm/{self.next_id}",
+            "condition": "Used",
+        }
+        if auction:
+            item["currentBidPrice"] = dict(price)
+            item["bidCount"] = self.random.randint(0, 20)
+        if self.random.random() < self.malformed_share:
+            broken = self.random.choice(["legacyItemId", "price", "itemEndDate"])
+            if broken == "itemEndDate":
+                item[broken] = "soon"
+            else:
+                item.pop(broken)
+                item.pop("currentBidPrice", None)
+        return item
+
+    def matches(self, query: str, item: dict) -> bool:
+        digest = hashlib.blake2b(
+            f"{query}|{item['itemId']}".encode(), digest_size=2
+        ).digest()
+        return int.from_bytes(digest, "big") < self.match_share * 0x10000
+
+    def search(self, params) -> list:
+        self.catch_up()
+        query = " ".join(params.get("q", "").lower().split())
+        filter_line = params.get("filter", "")
+
+        since = START_DATE_FILTER.search(filter_line)
+        since = since.group(1) if since else None
+        buying_options = BUYING_OPTIONS_FILTER.search(filter_line)
+        buying_options = (
+            set(buying_options.group(1).split("|")) if buying_options else None
+        )
+
+        found = [
+            item
+            for item in self.items
+            if self.matches(query, item)
+            and (not since or item["itemCreationDate"][:19] >= since[:19])
+            and (
+                not buying_options or buying_options & set(item["buyingOptions"])
+            )
+        ]
+        sort = params.get("sort")
+        if sort == "newlyListed":
+            found.reverse()
+        elif sort == "endingSoonest":
+            found.sort(key=lambda item: item["itemEndDate"])
+        return found
+
+
+# ---------------------------------------------------THE FAKE API---------------------------------------------------
+class FakeEbay:
+    """OAUTH TOKENS, item_summary/search AND get_item_by_legacy_id"""
+
+    def __init__(self, stream: ItemStream, faults: Faults, token_lifetime=7200):
+        self.stream = stream
+        self.faults = faults
+        self.token_lifetime = token_lifetime  # IN SECONDS, expires_in of a token
+        self.tokens = {}  # token: expires at, epoch
+        self.calls = Counter()  # endpoint: calls
+        self.statuses = Counter()  # http status: answers
+        self.first_served = {}  # item id: when it was first in an answer, epoch
+
+        self.app = web.Application()
+        self.app.router.add_post("/identity/v1/oauth2/token", self.token)
+        self.app.router.add_get("/buy/browse/v1/item_summary/search", self.search)
+        self.app.router.add_get(
+            "/buy/browse/v1/item/get_item_by_legacy_id", self.get_item
+        )
+        self.app.router.add_get("/stats", self.get_stats)
+
+    def answer(self, status: int, body: dict, headers=None) -> web.Response:
+        self.statuses[status] += 1
+        return web.json_response(body, status=status, headers=headers)
+
+    async def faulty(self, endpoint: str):
+        # None if the call goes through
+        self.calls[endpoint] += 1
+        await self.faults.delay()
+        if self.faults.throttled():
+            return self.answer(
+                429,
+                {"errors": [{"errorId": 2001, "message": "Too many requests."}]},
+                headers={"Retry-After": str(self.faults.retry_after)},
+            )
+        if self.faults.failed():
+            return self.answer(
+                500, {"errors": [{"errorId": 10001, "message": "System error."}]}
+            )
+
+    def authorized(self, request) -> bool:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return self.tokens.get(token, 0) > time.time()
+
+    async def token(self, request):
+        fault = await self.faulty("token")
+        if fault:
+            return fault
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = time.time() + self.token_lifetime
+        return self.answer(
+            200,
+            {
+                "access_token": token,
+                "expires_in": self.token_lifetime,
+                "token_type": "Application Access Token",
+            },
+        )
+
+    async def search(self, request):
+        fault = await self.faulty("search")
+        if fault:
+            return fault
+        if not self.authorized(request):
+            return self.answer(401, {"errors": [{"errorId": 1001}]})
+
+        params = request.query
+        try:
+            limit = min(max(int(params.get("limit", 50)), 1), 200)
+            offset = max(int(params.get("offset", 0)), 0)
+        except ValueError:
+            return self.answer(400, {"errors": [{"errorId": 12001}]})
+
+        found = self.stream.search(params)
+        page = found[offset : offset + limit]
+        body = {"href": str(request.url), "total": len(found), "limit": limit, "offset": offset}
+        if page:
+            body["itemSummaries"] = [self.served(item) for item in page]
+        return self.answer(200, body)
+
+    async def get_item(self, request):
+        fault = await self.faulty("get_item")
+        if fault:
+            return fault
+        if not self.authorized(request):
+            return self.answer(401, {"errors": [{"errorId": 1001}]})
+        item_id = request.query.get("legacy_item_id")
+        for item in reversed(self.stream.items):
+            if item.get("legacyItemId") == item_id:
+                return self.answer(200, self.served(item))
+        return self.answer(404, {"errors": [{"errorId": 11001}]})
+
+    def served(self, item: dict) -> dict:
+        item_id = item.get("legacyItemId")
+        if item_id:
+            self.first_served.setdefault(int(item_id), time.time())
+        return item
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "items": len(self.stream.items),
+        }
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats())
+
+
+# ---------------------------------------------------RUN IT---------------------------------------------------------
+def arguments(parser):
+    parser.add_argument("--items-per-minute", type=float, default=60)
+    parser.add_argument("--auction-share", type=float, default=0.5)
+    parser.add_argument("--malformed-share", type=float, default=0.01)
+    parser.add_argument("--match-share", type=float, default=0.3)
+    parser.add_argument("--token-lifetime", type=int, default=7200)
+    Faults.add_arguments(parser, prefix="ebay-")
+
+
+def from_arguments(args) -> FakeEbay:
+    stream = ItemStream(
+        items_per_minute=args.items_per_minute,
+        auction_share=args.auction_share,
+        malformed_share=args.malformed_share,
+        match_share=args.match_share,
+    )
+    return FakeEbay(
+        stream, Faults.from_arguments(args, prefix="ebay-"), args.token_lifetime
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="fake eBay Browse API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    arguments(parser)
+    args = parser.parse_args()
+
+    fake = from_arguments(args)
+    runner = await serve(fake.app, args.host, args.port)
+    print(f"fake eBay on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,187 @@
+"""A STAND-IN FOR THE TELEGRAM BOT API, ENOUGH FOR THE BOT TO MAIL
+
+python -m loadtest.fake_telegram --port 8082
+then TG_API_URL=http://127.0.0.1:8082 for the bot
+"""
+import argparse
+import asyncio
+from collections import Counter
+import hashlib
+import itertools
+import json
+import re
+import time
+
+from aiohttp import web
+
+from loadtest.faults import Faults, serve
+
+
+ITEM_LINK = re.compile(r"/itm/(\d+)")
+SENDING_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup"}
+
+
+# ---------------------------------------------------THE FAKE API---------------------------------------------------
+class FakeTelegram:
+    """ACCEPTS WHAT THE BOT SENDS; 429s FOR CHATS MAILED TOO OFTEN, LIKE TELEGRAM"""
+
+    def __init__(self, faults: Faults, chat_interval=1.0, blocked_chats=()):
+        self.faults = faults  # the global rate goes to faults.rate_per_second
+        self.chat_interval = chat_interval  # IN SECONDS, min between sends to a chat
+        self.blocked_chats = set(map(str, blocked_chats))  # users who blocked the bot
+        self.last_sent = {}  # chat id: monotonic
+        self.message_ids = itertools.count(1)
+        self.calls = Counter()  # method: calls
+        self.statuses = Counter()  # error code: answers, 200 is ok
+        self.deliveries = 0  # messages with an item link
+        self.photos = Counter()  # "uploaded" by url, "reused" by file_id
+        self.on_delivery = None  # callback(chat_id, item_id, epoch)
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.method)
+        self.app.router.add_get("/bot{token}/{method}", self.method)
+        self.app.router.add_get("/stats", self.get_stats)
+
+    def error(self, code: int, description: str, retry_after=None) -> web.Response:
+        self.statuses[code] += 1
+        body = {"ok": False, "error_code": code, "description": description}
+        if retry_after is not None:
+            body["parameters"] = {"retry_after": retry_after}
+        return web.json_response(body, status=code)
+
+    def ok(self, result) -> web.Response:
+        self.statuses[200] += 1
+        return web.json_response({"ok": True, "result": result})
+
+    async def method(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self.params(request)
+
+        await self.faults.delay()
+        if self.faults.throttled():
+            retry_after = max(1, int(self.faults.retry_after))
+            return self.error(
+                429, f"Too Many Requests: retry after {retry_after}", retry_after
+            )
+        if self.faults.failed():
+            return self.error(502, "Bad Gateway")
+
+        if method == "getMe":
+            return self.ok(
+                {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+            )
+        if method == "getUpdates":
+            # long polling with nothing to give
+            await asyncio.sleep(min(float(params.get("timeout") or 0), 1))
+            return self.ok([])
+        if method not in SENDING_METHODS:
+            return self.ok(True)  # deleteWebhook, setMyCommands, close, ...
+        return self.send(method, params)
+
+    def send(self, method: str, params: dict) -> web.Response:
+        chat_id = str(params.get("chat_id"))
+        if chat_id in self.blocked_chats:
+            return self.error(403, "Forbidden: bot was blocked by the user")
+
+        time_now = time.monotonic()
+        wait = self.last_sent.get(chat_id, 0) + self.chat_interval - time_now
+        if wait > 0:
+            return self.error(
+                429, f"Too Many Requests: retry after {wait:.0f}", max(1, round(wait))
+            )
+        self.last_sent[chat_id] = time_now
+
+        messages = self.messages_of(method, params)
+        for text, _ in messages:
+            for item_id in dict.fromkeys(ITEM_LINK.findall(text)):  # link text and url
+                self.delivered(chat_id, int(item_id))
+
+        chat = {"id": int(chat_id), "type": "private"}
+        results = []
+        for text, photo in messages:
+            message = {"message_id": next(self.message_ids), "date": int(time.time()), "chat": chat}
+            if photo:
+                message["caption"] = text
+                message["photo"] = [self.photo_size(photo)]
+            else:
+                message["text"] = text
+            results.append(message)
+        return self.ok(results if method == "sendMediaGroup" else results[0])
+
+    def photo_size(self, photo: str) -> dict:
+        if photo.startswith("http"):
+            self.photos["uploaded"] += 1
+            file_id = "fake-" + hashlib.sha1(photo.encode()).hexdigest()[:20]
+        else:
+            self.photos["reused"] += 1
+            file_id = photo
+        return {"file_id": file_id, "file_unique_id": file_id[-10:], "width": 225, "height": 225}
+
+    def delivered(self, chat_id: str, item_id: int):
+        received_at = time.time()
+        self.deliveries += 1
+        if self.on_delivery:
+            self.on_delivery(chat_id, item_id, received_at)
+
+    @staticmethod
+    def messages_of(method: str, params: dict) -> list:
+        """(text or caption, photo url or file_id) of each message sent"""
+        if method == "sendMediaGroup":
+            media = params.get("media") or "[]"
+            media = json.loads(media) if type(media) == str else media
+            return [(m.get("caption") or "", m.get("media")) for m in media] or [("", None)]
+        return [(params.get("text") or params.get("caption") or "", params.get("photo"))]
+
+    @staticmethod
+    async def params(request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        if request.method == "GET":
+            return dict(request.query)
+        return {k: v for k, v in (await request.post()).items() if type(v) == str}
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "deliveries": self.deliveries,
+            "photos": dict(self.photos),
+        }
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats())
+
+
+# ---------------------------------------------------RUN IT---------------------------------------------------------
+def arguments(parser):
+    parser.add_argument("--chat-interval", type=float, default=1.0)
+    parser.add_argument("--blocked-chats", default="", help="comma separated chat ids")
+    Faults.add_arguments(parser, prefix="tg-")
+
+
+def from_arguments(args) -> FakeTelegram:
+    blocked = [c for c in args.blocked_chats.split(",") if c]
+    return FakeTelegram(
+        Faults.from_arguments(args, prefix="tg-"), args.chat_interval, blocked
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    arguments(parser)
+    args = parser.parse_args()
+
+    fake = from_arguments(args)
+    runner = await serve(fake.app, args.host, args.port)
+    print(f"fake Telegram on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+
+# ---------------------------------------------------FAULTS OF A FAKE API--------------------------------------------
+class Faults:
+    """LATENCY, ERRORS AND 429s A FAKE SERVER ADDS TO ITS ANSWERS"""
+
+    def __init__(
+        self,
+        latency=0.05,
+        jitter=0.05,
+        error_rate=0.0,
+        rate_per_second=0,
+        retry_after=1,
+        seed=None,
+    ):
+        self.latency = latency  # IN SECONDS, every answer
+        self.jitter = jitter  # IN SECONDS, random extra on top
+        self.error_rate = error_rate  # share of 5xx answers
+        self.rate_per_second = rate_per_second  # 0 is no limit; 429 above it
+        self.retry_after = retry_after  # IN SECONDS, sent with a 429
+        self.random = random.Random(seed)
+        self.window = 0  # the current second
+        self.window_calls = 0
+
+    async def delay(self):
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def failed(self) -> bool:
+        return self.random.random() < self.error_rate
+
+    def throttled(self) -> bool:
+        if not self.rate_per_second:
+            return False
+        window = int(time.monotonic())
+        if window != self.window:
+            self.window, self.window_calls = window, 0
+        self.window_calls += 1
+        return self.window_calls > self.rate_per_second
+
+    @staticmethod
+    def add_arguments(parser, prefix=""):
+        # the same command line options for every fake
+        parser.add_argument(f"--{prefix}latency", type=float, default=0.05)
+        parser.add_argument(f"--{prefix}jitter", type=float, default=0.05)
+        parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0)
+        parser.add_argument(f"--{prefix}rate", type=float, default=0)
+        parser.add_argument(f"--{prefix}retry-after", type=float, default=1)
+
+    @classmethod
+    def from_arguments(cls, args, prefix=""):
+        prefix = prefix.replace("-", "_")
+        return cls(
+            latency=getattr(args, f"{prefix}latency"),
+            jitter=getattr(args, f"{prefix}jitter"),
+            error_rate=getattr(args, f"{prefix}error_rate"),
+            rate_per_second=getattr(args, f"{prefix}rate"),
+            retry_after=getattr(args, f"{prefix}retry_after"),
+        )
+
+
+# ---------------------------------------------------SERVING-------------------------------------------------------
+async def serve(app: web.Application, host: str, port: int) -> web.AppRunner:
+    """starts a fake in the running loop; await runner.cleanup() to stop it"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
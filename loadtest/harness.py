@@ -0,0 +1,218 @@
+"""END-TO-END LOAD TEST: THE REAL MAILING PIPELINE AGAINST THE FAKE EBAY AND TELEGRAM
+
+python -m loadtest.harness --users 50 --searches 4 --duration 600 --interval 60 --out load.json
+
+The fakes run in the same loop; the bot is pointed at them through EBAY_API_URL and
+TG_API_URL before any of its modules is imported. Users are put straight into
+user_data and the scheduler, no /start needed. Nothing is persisted: the app is
+never initialized, so no database is touched.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+from loadtest import fake_ebay, fake_telegram
+from loadtest.faults import serve
+
+
+# ---------------------------------------------------REPORT----------------------------------------------------------
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    at = lambda p: values[min(int(p * len(values)), len(values) - 1)]
+    return {
+        "count": len(values),
+        "p50": at(0.5),
+        "p90": at(0.9),
+        "p99": at(0.99),
+        "max": values[-1],
+    }
+
+
+class Recorder:
+    """WHAT THE FAKES SAW, TURNED INTO NUMBERS"""
+
+    def __init__(self, ebay, telegram):
+        self.ebay = ebay
+        self.telegram = telegram
+        self.send_latencies = []  # IN SECONDS, first served by eBay to sent to Telegram
+        self.listing_latencies = []  # IN SECONDS, listed on eBay to sent to Telegram
+        self.memory = []  # (seconds from start, traced bytes)
+        self.started_at = time.time()
+        telegram.on_delivery = self.delivered
+
+    def delivered(self, chat_id, item_id, received_at):
+        served_at = self.ebay.first_served.get(item_id)
+        if served_at:
+            self.send_latencies.append(received_at - served_at)
+        listed_at = self.ebay.stream.listed.get(item_id)
+        if listed_at:
+            self.listing_latencies.append(received_at - listed_at)
+
+    async def sample_memory(self, every_seconds):
+        while True:
+            current, _ = tracemalloc.get_traced_memory()
+            self.memory.append((round(time.time() - self.started_at), current))
+            await asyncio.sleep(every_seconds)
+
+    def report(self, args, extra: dict) -> dict:
+        elapsed = time.time() - self.started_at
+        ebay_calls = sum(
+            n for endpoint, n in self.ebay.calls.items() if endpoint != "token"
+        )
+        delivered = self.telegram.deliveries
+        current, peak = tracemalloc.get_traced_memory()
+        first = self.memory[0][1] if self.memory else current
+        return {
+            "users": args.users,
+            "searches_per_user": args.searches,
+            "distinct_queries": args.distinct_queries,
+            "poll_interval": args.interval,
+            "elapsed": elapsed,
+            "delivered": delivered,
+            "throughput_per_second": delivered / elapsed if elapsed else 0,
+            "ebay_calls": ebay_calls,
+            "ebay_calls_per_delivered_item": ebay_calls / delivered if delivered else None,
+            "ebay": self.ebay.stats(),
+            "telegram": self.telegram.stats(),
+            "send_latency": percentiles(self.send_latencies),
+            "listing_latency": percentiles(self.listing_latencies),
+            "memory": {
+                "traced_start": first,
+                "traced_end": current,
+                "traced_peak": peak,
+                "growth": current - first,
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "samples": self.memory,
+            },
+            **extra,
+        }
+
+
+# ---------------------------------------------------THE BOT UNDER LOAD--------------------------------------------
+def point_the_bot_at_the_fakes(args):
+    # before the first import of settings: they are read once
+    os.environ["EBAY_API_URL"] = f"http://{args.host}:{args.ebay_port}"
+    os.environ["TG_API_URL"] = f"http://{args.host}:{args.tg_port}"
+    os.environ["TG_BOT_TOKEN"] = "123456:LOAD-TEST"
+    os.environ["ENCODED_CREDENTIALS"] = "bG9hZDp0ZXN0"
+    os.environ.setdefault("MY_TG_ID", "1")
+
+    from settings import settings
+
+    settings.MIN_POLL_INTERVAL = min(settings.MIN_POLL_INTERVAL, args.interval)
+    settings.QUEUE_TIME_INERVAL = args.interval
+    settings.MAX_EBAY_API_CALLS = args.ebay_budget
+
+
+def add_users(args, application, mailing_scheduler):
+    from settings.settings import DEFAULT_CALL_PARAMS2
+
+    for u in range(args.users):
+        user_id = args.first_user_id + u
+        user_data = application.user_data[user_id]  # a defaultdict underneath
+        user_data["status"] = "on"
+        user_data["info"] = {"user_id": str(user_id), "username": f"@load{u}"}
+        user_data["delivery"] = args.delivery
+        search_nums = []
+        for s in range(args.searches):
+            search_num = str(s + 1)
+            query = (u * args.searches + s) % args.distinct_queries
+            user_data[search_num] = dict(
+                DEFAULT_CALL_PARAMS2, q=f"load test {query}", limit=str(args.limit)
+            )
+            search_nums.append(search_num)
+        mailing_scheduler.schedule_user(str(user_id), search_nums)
+
+
+async def run(args):
+    ebay = fake_ebay.from_arguments(args)
+    telegram = fake_telegram.from_arguments(args)
+    runners = [
+        await serve(ebay.app, args.host, args.ebay_port),
+        await serve(telegram.app, args.host, args.tg_port),
+    ]
+
+    point_the_bot_at_the_fakes(args)
+    tracemalloc.start()
+    from settings.app import application, send_queue
+    from utils.delivery import photo_file_ids
+    from settings.background_objects import (
+        background_stuff,
+        close_all_background_stuff,
+        launch_all_background_stuff,
+        mailing_scheduler,
+        search_cache,
+        ebay_rate_limiter,
+        seen_store,
+    )
+    import handlers.mailing  # noqa: sets the scheduler job
+
+    await application.bot.initialize()
+    recorder = Recorder(ebay, telegram)
+    add_users(args, application, mailing_scheduler)
+    launch_all_background_stuff()
+    sampler = asyncio.ensure_future(recorder.sample_memory(args.sample))
+
+    try:
+        await asyncio.sleep(args.duration)
+    finally:
+        sampler.cancel()
+        for thing in background_stuff:
+            thing.background_refresher_off()
+        await close_all_background_stuff(application)
+        await application.bot.shutdown()
+        for runner in runners:
+            await runner.cleanup()
+
+    return recorder.report(
+        args,
+        {
+            "scheduler": mailing_scheduler.stats(),
+            "search_cache": search_cache.stats(),
+            "ebay_rate_limiter": ebay_rate_limiter.stats(),
+            "send_queue": send_queue.stats(),
+            "seen_store": seen_store.stats(),
+            "photo_file_ids": photo_file_ids.stats(),
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test against fake APIs")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--searches", type=int, default=4, help="per user")
+    parser.add_argument(
+        "--distinct-queries", type=int, default=0, help="0: every search its own"
+    )
+    parser.add_argument("--limit", type=int, default=15, help="items per page")
+    parser.add_argument("--delivery", default="items", help="items, digest or album")
+    parser.add_argument("--duration", type=float, default=300, help="seconds")
+    parser.add_argument("--interval", type=int, default=60, help="poll seconds")
+    parser.add_argument("--ebay-budget", type=int, default=10**6, help="calls a day")
+    parser.add_argument("--sample", type=float, default=10, help="memory, seconds")
+    parser.add_argument("--first-user-id", type=int, default=10**9)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ebay-port", type=int, default=8081)
+    parser.add_argument("--tg-port", type=int, default=8082)
+    parser.add_argument("--out", help="json report file; stdout if not set")
+    fake_ebay.arguments(parser)
+    fake_telegram.arguments(parser)
+    args = parser.parse_args()
+    args.distinct_queries = args.distinct_queries or args.users * args.searches
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ def redacted(error_msg: str) -> str:
     error_msg = re.sub(r"(https://api.telegram.org/).*", r"\1 [REDACTED]", error_msg)
     error_msg = re.sub(r"(https://api.ebay.com/).*", r"\1 [REDACTED]", error_msg)
     error_msg = re.sub(r"(https://api.openai.com/v1/).*", r"\1 [REDACTED]", error_msg)
+    error_msg = re.sub(r"bot\d+:[\w-]+", "bot[REDACTED]", error_msg)  # any TG_API_URL
     return error_msg
 
 
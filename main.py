@@ -1,4 +1,5 @@
-from telegram.ext import CommandHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import CommandHandler, MessageHandler, TypeHandler, filters
 
 from logs.mylogging import time_log_decorator
 
@@ -6,8 +7,13 @@ from handlers import user
 from handlers import admin
 from handlers import data_erasure
 from handlers import support
+from handlers.role_check import authorize
 
-from settings.background_objects import launch_all_background_stuff
+from settings.background_objects import (
+    launch_all_background_stuff,
+    on_data_loaded,
+    close_all_background_stuff,
+)
 from settings.app import application
 
 
@@ -20,6 +26,8 @@ def telegram_bot(application):
         user.add,
         user.searches,
         user.delete,
+        user.alerts,
+        user.delivery,
         support.support,
         user.help,
     ]
@@ -50,6 +58,11 @@ def telegram_bot(application):
     ]
 
     application.add_error_handler(user.error)
+    application.post_init = on_data_loaded
+    application.post_shutdown = close_all_background_stuff
+
+    # authorization middleware: before all the handlers below, in group 0
+    application.add_handler(TypeHandler(Update, authorize), group=-1)
 
     for handler in other_handlers:
         application.add_handler(
@@ -1,29 +1,72 @@
-from mongopersistence import MongoPersistence
 from telegram.ext import ApplicationBuilder
 
-from settings.settings import MONGO_URL, TG_BOT_TOKEN
+from settings.settings import (
+    PERSISTENCE_BACKEND,
+    PERSISTENCE_UPDATE_INTERVAL,
+    SQLITE_PATH,
+    SQLITE_WRITE_BEHIND,
+    MONGO_URL,
+    MONGO_DB_NAME,
+    MONGO_USER_DATA_COLLECTION,
+    MONGO_BOT_DATA_COLLECTION,
+    TG_BOT_TOKEN,
+    TG_API_URL,
+    TG_MESSAGES_PER_SECOND,
+    TG_MESSAGES_BURST,
+    TG_CHAT_INTERVAL,
+    TG_GROUP_CHAT_INTERVAL,
+    TG_MAX_RETRIES,
+    SEND_QUEUE_HIGH_WATER,
+    SEND_QUEUE_LOW_WATER,
+)
+from settings.sqlite_persistence import SQLitePersistence
+from utils.send_queue import SendQueue
 
 # from ..handlers.start_stop import on_startup, on_shutdown
 
 
 # -------------------------------------------TELEGRAM BOT DB------------------------------
-persistence = MongoPersistence(
-    mongo_url=MONGO_URL,
-    db_name="vintage-mania-database",
-    name_col_user_data="user-data-collection",
-    name_col_bot_data="bot-data-collection",
-    create_col_if_not_exist=True,
-    # ignore_general_data=["cache"],
-    # ignore_user_data=["foo", "bar"],
-    load_on_flush=False,
-    update_interval=60,
+if PERSISTENCE_BACKEND == "sqlite":
+    persistence = SQLitePersistence(
+        SQLITE_PATH,
+        update_interval=PERSISTENCE_UPDATE_INTERVAL,
+        write_behind=SQLITE_WRITE_BEHIND,
+    )
+else:
+    from mongopersistence import MongoPersistence  # the optional mongo dependencies
+
+    persistence = MongoPersistence(
+        mongo_url=MONGO_URL,
+        db_name=MONGO_DB_NAME,
+        name_col_user_data=MONGO_USER_DATA_COLLECTION,
+        name_col_bot_data=MONGO_BOT_DATA_COLLECTION,
+        create_col_if_not_exist=True,
+        # ignore_general_data=["cache"],
+        # ignore_user_data=["foo", "bar"],
+        load_on_flush=False,
+        update_interval=PERSISTENCE_UPDATE_INTERVAL,
+    )
+
+# --------------------------------------------TELEGRAM OUTBOX-------------------------------
+# every bot call waits here: global rate, per-chat pacing, admin before the feed
+send_queue = SendQueue(
+    TG_MESSAGES_PER_SECOND,
+    TG_MESSAGES_BURST,
+    TG_CHAT_INTERVAL,
+    TG_GROUP_CHAT_INTERVAL,
+    TG_MAX_RETRIES,
+    SEND_QUEUE_HIGH_WATER,
+    SEND_QUEUE_LOW_WATER,
 )
 
 # --------------------------------------------TELEGRAM APP---------------------------------
 application = (
     ApplicationBuilder()
     .token(TG_BOT_TOKEN)
+    .base_url(f"{TG_API_URL}/bot")
+    .base_file_url(f"{TG_API_URL}/file/bot")
     .persistence(persistence)
+    .rate_limiter(send_queue)
     # .post_init(on_startup) # these cause errors in notifiction sending!
     # .post_shutdown(on_shutdown) # both sync and async funcs don't work
     .build()
@@ -1,28 +1,110 @@
-from settings.background_tasks import CounterDown, EbayToken, NotifyAdminTG, CleanUsers
+import asyncio
 
-from settings.settings import MAX_EBAY_API_CALLS, MAX_OPENAI_API_CALLS
-from settings.app import application
+from settings.background_tasks import (
+    CounterDown,
+    EbayClient,
+    EbayToken,
+    SearchCache,
+    NotifyAdminTG,
+    CleanUsers,
+)
+from settings.mailing_scheduler import MailingScheduler
+from settings.ending_alerts import EndingAlerts
+from settings.seen_store import SeenStore, SQLiteSeenItems
+
+from settings.settings import (
+    MAX_EBAY_API_CALLS,
+    MAX_OPENAI_API_CALLS,
+    SEARCH_CACHE_TTL,
+    EBAY_CALLS_PER_SECOND,
+    EBAY_CALLS_BURST,
+    QUEUE_TIME_INERVAL,
+    MAILING_WORKERS,
+    MAILING_QUEUE_SIZE,
+    EBAY_CONCURRENT_SEARCHES,
+    MAX_ENDING_ALERTS,
+    PERSISTENCE_BACKEND,
+    MONGO_URL,
+    MONGO_DB_NAME,
+    MONGO_SEEN_ITEMS_COLLECTION,
+    MAX_CACHE_LEN,
+    SEEN_ITEM_END_GRACE,
+    SEEN_ITEMS_KEPT,
+    SEEN_ITEMS_FLUSH_INTERVAL,
+    USER_INACTIVITY_EXPIRY,
+    INACTIVE_USERS_SWEEP_INTERVAL,
+)
+from settings.app import application, persistence
+from utils.active_users import active_users
+from utils.rate_limit import TokenBucket
 
 # -------- Tasks on the back managers : BackgroundRefresher children -----------------------------------
 
 # data on my server
 ebay_call_counter = CounterDown("EBAY", MAX_EBAY_API_CALLS) # counts ebay calls per day
 open_ai_call_counter = CounterDown("OPENAI", MAX_OPENAI_API_CALLS) # same for openai
-refreshing_ebay_token = EbayToken() # refreshes ebay access token
+ebay_client = EbayClient() # keeps the ebay connection pool alive
+refreshing_ebay_token = EbayToken(ebay_client) # refreshes ebay access token
+search_cache = SearchCache(SEARCH_CACHE_TTL) # same searches of different users share a call
+ebay_rate_limiter = TokenBucket("EBAY", EBAY_CALLS_PER_SECOND, EBAY_CALLS_BURST) # all ebay calls queue here
+ebay_search_semaphore = asyncio.Semaphore(EBAY_CONCURRENT_SEARCHES) # searches in flight, all users
 
 # works with the app database or requires app
 notifyer = NotifyAdminTG(application) # can cache messages sent to the admin group
-users_cleaner = CleanUsers(application) # cleans unactive users once in a while
+if PERSISTENCE_BACKEND == "sqlite":
+    seen_items_backend = SQLiteSeenItems(persistence.database, SEEN_ITEMS_KEPT)
+elif MONGO_URL:
+    from settings.mongo_seen_store import MongoSeenItems # the optional mongo dependencies
+
+    seen_items_backend = MongoSeenItems(
+        MONGO_URL, MONGO_DB_NAME, MONGO_SEEN_ITEMS_COLLECTION, SEEN_ITEMS_KEPT
+    )
+else:
+    seen_items_backend = None # no database: in memory only
+seen_store = SeenStore(
+    application,
+    seen_items_backend,
+    MAX_CACHE_LEN,
+    SEEN_ITEM_END_GRACE,
+    SEEN_ITEMS_FLUSH_INTERVAL,
+) # seen items per user; only the new ones are written
+users_cleaner = CleanUsers(
+    application, seen_store, USER_INACTIVITY_EXPIRY, INACTIVE_USERS_SWEEP_INTERVAL
+) # frees the slots of users silent for too long
+mailing_scheduler = MailingScheduler(
+    QUEUE_TIME_INERVAL, MAILING_WORKERS, MAILING_QUEUE_SIZE, MAX_EBAY_API_CALLS
+) # polls every user search in its own time slot
+ending_alerts = EndingAlerts(application, MAX_ENDING_ALERTS) # opt-in alerts before auctions end
 
 # my app components other than telegram
 background_stuff = [
     ebay_call_counter,
     open_ai_call_counter,
+    ebay_client,
     refreshing_ebay_token,
+    search_cache,
     notifyer,
+    seen_store,
     users_cleaner,
+    mailing_scheduler,
+    ending_alerts,
 ]
 
 def launch_all_background_stuff():
     for thing in background_stuff:
         thing.background_refresher_on()
+
+
+async def on_data_loaded(application):
+    # application.post_init hook: bot_data is loaded from persistence by now,
+    # the refreshers were launched before it
+    active_users(application.bot_data)  # indexes the users of a legacy seen items cache
+    ending_alerts.loaded()
+
+
+async def close_all_background_stuff(application):
+    # application.post_shutdown hook; open connections die with the app
+    await seen_store.flush()
+    if PERSISTENCE_BACKEND == "sqlite":
+        persistence.database.close() # the app flushed it already, seen items came after: the final close
+    await ebay_client.close()
@@ -1,17 +1,21 @@
+import aiohttp
 import asyncio
-from datetime import datetime, timedelta
+import random
+import time
 
 from logs.mylogging import logger, redacted, time_log_decorator
 from . import settings
 
 from ebay import ebay_token
+from utils.active_users import active_users, drop_active, activity_expiry
+from utils.admin_alerts import AlertAggregator
+from utils.broadcast import broadcast, summary
 
 
 # all app background processes live here
 # convention:
-# all keys are unique
-# user_id:mailing task for my telegram users
-# a unique string for others
+# all keys are unique strings
+# users are mailed by the mailing_scheduler task, not a task per user
 # telegram runs the loop
 task_storage = {}
 
@@ -79,25 +83,191 @@ class BackgroundRefresher:
 
 
 class EbayToken(BackgroundRefresher):
-    def __init__(self):
+    """EBAY APP TOKEN REFRESHED AHEAD OF EXPIRY; ONE REFRESH SHARED BY ALL CALLERS"""
+
+    def __init__(self, client):
         self.process_name = "ebay_token_refresher"
         self.refresh_rate_seconds = 60 * 60 * 2
         self.on = False
+        self.client = client  # token requests use the ebay connection pool
         self.value = None
+        self.expires_at = 0  # monotonic
+        self.refreshing = None  # the in-flight refresh
+
+    def is_fresh(self):
+        margin = settings.EBAY_TOKEN_REFRESH_AHEAD
+        return self.value is not None and time.monotonic() < self.expires_at - margin
+
+    async def get(self):
+        """a valid token, never None; waits for the refresh if needed"""
+        if not self.is_fresh():
+            await self.refresh()
+        return self.value
+
+    async def refresh(self, stale=None):
+        # stale: the token eBay refused; no new refresh if it's already replaced
+        if stale is not None and self.value != stale and self.is_fresh():
+            return self.value
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self.fetch_with_retries())
+        return await asyncio.shield(self.refreshing)
+
+    async def fetch_with_retries(self):
+        try:
+            delay = 1
+            for attempt in range(settings.EBAY_TOKEN_RETRIES):
+                try:
+                    session = await self.client.open()
+                    result = await ebay_token.get_app_token(session)
+                    self.value = result["access_token"]
+                    self.expires_at = time.monotonic() + result["expires_in"]
+                    logger.info("EBAY TOKEN UPDATED")
+                    return self.value
+                except Exception as e:
+                    logger.error(f"ERROR IN EBAY TOKEN UPDATER {redacted(str(e))}")
+                    await asyncio.sleep(delay + random.uniform(0, delay))
+                    delay = min(delay * 2, 60)
+            raise ebay_token.EbayTokenError("eBay token is unavailable")
+        finally:
+            self.refreshing = None
 
     async def refresher(self):
         while self.on:
             try:
-                # block all other tasks because important
-                result = ebay_token.get_app_token()
-                self.value = result["access_token"]
-                logger.info("EBAY TOKEN UPDATED")
-                self.refresh_rate_seconds = result["expires_in"] - 5
-            except Exception as e:
-                logger.error(f"ERROR IN EBAY TOKEN UPDATER {redacted(str(e))}")
-                raise e
-            finally:
+                await self.refresh()
+            except Exception:
+                await asyncio.sleep(60)  # logged already; try again soon
+                continue
+            # jitter: refreshes of restarted instances don't line up
+            ahead = settings.EBAY_TOKEN_REFRESH_AHEAD * (1 + random.random())
+            self.refresh_rate_seconds = max(
+                self.expires_at - ahead - time.monotonic(), 1
+            )
+            await asyncio.sleep(self.refresh_rate_seconds)
+
+
+class EbayClient(BackgroundRefresher):
+    """ONE KEEP-ALIVE CONNECTION POOL FOR ALL EBAY CALLS"""
+
+    def __init__(self):
+        self.process_name = "ebay_http_client"
+        self.refresh_rate_seconds = 60 * 60  # pool stats to the logs
+        self.on = False
+        self.session = None
+
+    async def open(self):
+        # lazy as well: the session has to be created inside the running loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.EBAY_POOL_LIMIT,
+                limit_per_host=settings.EBAY_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=settings.EBAY_DNS_CACHE_TTL,
+                keepalive_timeout=settings.EBAY_KEEPALIVE_TIMEOUT,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=settings.EBAY_REQUEST_TIMEOUT,
+                connect=settings.EBAY_CONNECT_TIMEOUT,
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            logger.info("EBAY HTTP POOL OPENED")
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("EBAY HTTP POOL CLOSED")
+        self.session = None
+
+    def stats(self):
+        if self.session is None or self.session.closed:
+            return {"open": 0, "idle": 0, "in_use": 0}
+        connector = self.session.connector
+        try:
+            # aiohttp keeps no public counters for this
+            idle = sum(len(conns) for conns in connector._conns.values())
+            in_use = len(connector._acquired)
+        except AttributeError:
+            return {"open": 0, "idle": 0, "in_use": 0}
+        return {"open": idle + in_use, "idle": idle, "in_use": in_use}
+
+    async def refresher(self):
+        try:
+            await self.open()
+            while self.on:
                 await asyncio.sleep(self.refresh_rate_seconds)
+                logger.info(f"EBAY HTTP POOL: {self.stats()}")
+        finally:
+            await self.close()
+
+
+class SearchCache(BackgroundRefresher):
+    """SHARED SEARCH RESULTS; ONE IN-FLIGHT EBAY CALL PER SEARCH KEY"""
+
+    def __init__(self, ttl_seconds):
+        self.process_name = "ebay_search_cache_cleaner"
+        self.refresh_rate_seconds = ttl_seconds
+        self.on = False
+        self.ttl_seconds = ttl_seconds
+        self.results = {}  # key: (expires_at, result)
+        self.in_flight = {}  # key: task every caller of the key waits on
+        self.waiters = {}  # in-flight task: how many callers wait on it
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, fetch):
+        # fetch is a coroutine function; string results are errors
+        cached = self.results.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+
+        task = self.in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self.fetch_and_store(key, fetch))
+            self.in_flight[key] = task
+        else:
+            self.hits += 1
+
+        # one caller cancelled does not cancel the call for the others
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1:  # nobody else needs it
+                task.cancel()
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+
+    async def fetch_and_store(self, key, fetch):
+        try:
+            result = await fetch()
+            if type(result) != str:  # error messages are not cached
+                self.results[key] = (time.monotonic() + self.ttl_seconds, result)
+            return result
+        finally:
+            self.in_flight.pop(key, None)
+
+    def clear_expired(self):
+        time_now = time.monotonic()
+        for key in [k for k, v in self.results.items() if v[0] <= time_now]:
+            self.results.pop(key, None)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.results),
+            "in_flight": len(self.in_flight),
+            "hit_rate": self.hits / requests if requests else 0,
+        }
+
+    async def refresher(self):
+        while self.on:
+            await asyncio.sleep(self.refresh_rate_seconds)
+            self.clear_expired()
 
 
 class CounterDown(BackgroundRefresher):
@@ -126,6 +296,13 @@ class CounterDown(BackgroundRefresher):
     def call(self):
         self.value -= 1
 
+    def reserve(self, amount=1):
+        # no await between the check and the call: atomic for the loop
+        if self.value < amount:
+            return False
+        self.value -= amount
+        return True
+
 
 class CleanUsers(BackgroundRefresher):
     # https://docs.python-telegram-bot.org/en/v20.7/telegram.ext.application.html#telegram.ext.Application.drop_user_data
@@ -135,93 +312,117 @@ class CleanUsers(BackgroundRefresher):
     # the deletion commit does not reach the actual storage, and the other way around.
     # Thus, we will be handling user data deletion as follows
 
-    def __init__(self, app):
+    # convention:
+    # users are indexed by their last successful poll or command (activity_expiry);
+    # a sweep pops only the expired ones, so it runs often and frees slots on time
+
+    def __init__(self, app, seen_store, expiry_seconds, sweep_seconds):
         self.process_name = "inactive_user_cleaner"
-        self.refresh_rate_seconds = 4 * 24 * 60 * 60  # 4 days
+        self.refresh_rate_seconds = sweep_seconds
         self.on = False
         self.app = app
+        self.seen_store = seen_store
+        self.expiry_seconds = expiry_seconds
+        self.last_sweep_freed = 0
 
     def erase_user(self, user_id: int):
         self.app.drop_user_data(user_id)
-        self.app.bot_data.get("cache", {}).pop(f"{user_id}")
+        drop_active(self.app.bot_data, f"{user_id}")
+        self.seen_store.drop_user(f"{user_id}")
         logger.info(f"User {user_id} removed")
 
     def clear_unactive_users(self):
-        time_now = datetime.now()
-        cache = self.app.bot_data.get("cache", {})
-        all_users = list(cache.keys())  # my convention
-        for user in all_users:
-            last_mailed = self.app.user_data.get(user, {}).get("last_mailed")
-            if last_mailed and (time_now - last_mailed) >= timedelta(days=7):
-                self.erase_user(int(user))
+        expired = activity_expiry.pop_expired(
+            active_users(self.app.bot_data), time.time() - self.expiry_seconds
+        )
+        for user in expired:
+            self.erase_user(int(user))
+        self.last_sweep_freed = len(expired)
+        if expired:
+            logger.info(f"INACTIVE USERS CLEARED: {len(expired)}")
 
     async def refresher(self):
         while self.on:
-            logger.info(f"CLEARING INACTIVE USERS")
+            await asyncio.sleep(self.refresh_rate_seconds)  # bot_data is loaded by then
             self.clear_unactive_users()
-            logger.info(f"INACTIVE USERS CLEARED")
-            await asyncio.sleep(self.refresh_rate_seconds)
+
+    def stats(self) -> dict:
+        index = activity_expiry.stats()
+        next_expiry = activity_expiry.next_expiry()
+        index["last_sweep"] = self.last_sweep_freed
+        index["next_in"] = (
+            0 if next_expiry is None
+            else max(0, next_expiry + self.expiry_seconds - time.time())
+        )
+        return index
 
 
 class NotifyAdminTG(BackgroundRefresher):
     def __init__(self, app):
         self.process_name = "admin_notification_cache_refresher"
-        self.refresh_rate_seconds = 60 * 60 * 3
+        self.refresh_rate_seconds = settings.ADMIN_ALERT_WINDOW
         self.on = False
         self.admin_ids = settings.ADMIN_GROUP
         self.app = app
-        self.cache = []  # notifications that shouldn't appear more than once in a while
+        # notifications that shouldn't appear more than once in a while
+        self.alerts = AlertAggregator(settings.ADMIN_ALERT_WINDOW)
 
     async def refresher(self):
         while self.on:
-            self.cache = []
-            await asyncio.sleep(self.refresh_rate_seconds)
+            await self.flush_repeats()
+            next_expiry = self.alerts.next_expiry_in()
+            await asyncio.sleep(
+                self.refresh_rate_seconds if next_expiry is None else next_expiry + 1
+            )
+
+    async def flush_repeats(self):
+        for text, repeats in self.alerts.expired():
+            minutes = self.refresh_rate_seconds // 60
+            await self.send(text=f"🔁 {repeats} more in {minutes} min like:\n\n{text}")
 
     async def send(
-        self, text=None, group=[], photo_id=None, once=False, parse_mode=None
+        self,
+        text=None,
+        group=[],
+        photo_id=None,
+        once=False,
+        parse_mode=None,
+        fingerprint=None,
     ):
-        if (str(photo_id) in self.cache) or (text in self.cache):
-            return
+        """to the admins or the group; a broadcast report, None if nothing was sent
 
+        once: repeats of the alert template are held back and summed up later;
+        fingerprint: the exact key to compare instead of the template of the text
+        """
         if not text and not photo_id:
             return
 
-        if not group:
-            group = self.admin_ids
-
-        for tg_id in group:
-            try:
-                if photo_id and text:
-                    await self.app.bot.send_photo(
-                        chat_id=tg_id, photo=photo_id, caption=text
-                    )
-                elif photo_id:
-                    await self.app.bot.send_photo(chat_id=tg_id, photo=photo_id)
-
-                elif text:
-                    await self.app.bot.send_message(
-                        chat_id=tg_id, text=text, parse_mode=parse_mode
-                    )
-
-            except Exception as e:
-                logger.error(f"Failed to send: f{str(e)}")
+        if once:
+            await self.flush_repeats()  # the refresher is off with the support
+            if not self.alerts.add(text or str(photo_id), key=fingerprint):
                 return
 
-        if once:
-            self.cache.append(text)
-            if photo_id:
-                self.cache.append(str(photo_id))
+        return await broadcast(
+            self.app.bot,
+            group or self.admin_ids,
+            text=text,
+            photo_id=photo_id,
+            parse_mode=parse_mode,
+            notification=not group,
+        )
 
     async def log_and_notify_admin(self, text, once=False):
-        if text in self.cache:
-            return
+        if once:
+            await self.flush_repeats()
+            if not self.alerts.add(text):
+                return
         logger.info(text)
-        await self.send(text=text, once=once)
+        await self.send(text=text)
 
     async def send_all_active_users(self, text, photo_id=None, parse_mode=None):
-        all_active_users = self.app.bot_data.get("cache", {}).keys()
+        all_active_users = list(active_users(self.app.bot_data).keys())
         if all_active_users:
-            await self.send(
+            return await self.send(
                 text=text,
                 group=all_active_users,
                 photo_id=photo_id,
@@ -232,8 +433,16 @@ class NotifyAdminTG(BackgroundRefresher):
         NOTIFICATION = (
             "🍑 *The bot is up again\!*\n\n_to resume posting_ /pause _\+_ /start"
         )
-        await self.send_all_active_users(NOTIFICATION, parse_mode="MarkDownV2")
+        report = await self.send_all_active_users(
+            NOTIFICATION, parse_mode="MarkDownV2"
+        )
+        if report:
+            await self.log_and_notify_admin(f"Restart notice: {summary(report)}")
 
     async def notify_on_shutdown(self):
         NOTIFICATION = "😴 *The bot is down\.*"
-        await self.send_all_active_users(NOTIFICATION, parse_mode="MarkDownV2")
+        report = await self.send_all_active_users(
+            NOTIFICATION, parse_mode="MarkDownV2"
+        )
+        if report:
+            await self.log_and_notify_admin(f"Shutdown notice: {summary(report)}")
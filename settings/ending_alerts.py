@@ -0,0 +1,95 @@
+import asyncio
+import heapq
+import time
+
+from logs.mylogging import logger, redacted
+from settings import settings
+from settings.background_tasks import BackgroundRefresher
+
+
+# ----------------------------------------------ENDING SOON ALERTS------------------------------------------
+class EndingAlerts(BackgroundRefresher):
+    """ONE HEAP OF "ENDING SOON" ALERTS FOR SEEN AUCTIONS, KEPT IN bot_data"""
+
+    # convention:
+    # heap entries are [fire_at, user_id, item_id, end_date, bid_price]
+    # fire_at is an epoch timestamp, user_id a string, end_date the eBay ISO string
+    # the heap is a plain list in bot_data, so persistence keeps it over restarts
+
+    def __init__(self, app, capacity):
+        self.process_name = "ending_alerts"
+        self.refresh_rate_seconds = 60 * 60  # idle wake up
+        self.on = False
+        self.app = app
+        self.capacity = capacity  # pending alerts of all users
+        self.job = None  # async job(user_id, item_id, end_date, bid_price); set by handlers.mailing
+        self.wake_up = asyncio.Event()
+        self.fired = 0
+        self.dropped = 0
+
+    @property
+    def heap(self) -> list:
+        # bot_data is replaced when the app loads persistence: never hold it
+        return self.app.bot_data.setdefault("ending_alerts", [])
+
+    def add(self, user_id: str, item, end_timestamp: int, minutes: int):
+        """item: a seen auction ItemSummary; False if no alert is coming"""
+        fire_at = end_timestamp - minutes * 60
+        if fire_at <= time.time():
+            return False  # ends sooner than the alert would come
+        heap = self.heap
+        if len(heap) >= self.capacity:
+            self.dropped += 1
+            return False
+        entry = [fire_at, user_id, item.item_id, item.end_date, item.bid_price]
+        heapq.heappush(heap, entry)
+        if heap[0] is entry:
+            self.wake_up.set()
+        return True
+
+    def loaded(self):
+        """bot_data came from persistence: its alerts may be due before the idle wake up"""
+        heapq.heapify(self.heap)
+        self.wake_up.set()
+
+    def drop_user(self, user_id: str):
+        heap = [entry for entry in self.heap if entry[1] != user_id]
+        heapq.heapify(heap)
+        self.app.bot_data["ending_alerts"] = heap
+
+    def pop_due(self, time_now: float) -> list:
+        heap = self.heap
+        due = []
+        while heap and heap[0][0] <= time_now:
+            due.append(heapq.heappop(heap))
+        return due
+
+    async def refresher(self):
+        while self.on:
+            self.wake_up.clear()
+            for _, user_id, item_id, end_date, bid_price in self.pop_due(time.time()):
+                try:
+                    await self.job(user_id, item_id, end_date, bid_price)
+                    self.fired += 1
+                except Exception as e:
+                    logger.error(
+                        f"Error in ending alert of user {user_id}: {redacted(str(e))}"
+                    )
+
+            heap = self.heap
+            timeout = heap[0][0] - time.time() if heap else self.refresh_rate_seconds
+            try:
+                await asyncio.wait_for(
+                    self.wake_up.wait(), min(max(0, timeout), self.refresh_rate_seconds)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        heap = self.heap
+        return {
+            "pending": len(heap),
+            "next_in": max(0, heap[0][0] - time.time()) if heap else 0,
+            "fired": self.fired,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,213 @@
+import asyncio
+from collections import deque
+import heapq
+import itertools
+import math
+import time
+
+from logs.mylogging import logger, redacted
+from settings import settings
+from settings.background_tasks import BackgroundRefresher
+
+
+# golden ratio steps: the n-th search ever scheduled lands in the biggest gap
+GOLDEN_RATIO = (5**0.5 - 1) / 2
+
+
+# ----------------------------------------------MAILING SCHEDULER------------------------------------------
+class MailingScheduler(BackgroundRefresher):
+    """ONE HEAP OF PER-SEARCH DUE TIMES SERVED BY A BOUNDED WORKER POOL"""
+
+    # convention:
+    # a key is (user_id, search_num), both strings as in task_storage and user_data
+    # heap entries are [due, seq, user_id, search_num, alive]; paused ones are marked dead
+    # a poll is charged its page budget in eBay calls: the most it can spend
+
+    def __init__(self, interval_seconds, workers_amount, queue_size, daily_calls):
+        self.process_name = "mailing_scheduler"
+        self.refresh_rate_seconds = interval_seconds
+        self.on = False
+        self.interval_seconds = interval_seconds  # default per search
+        self.daily_calls = daily_calls  # all searches together stay under it
+        self.workers_amount = workers_amount
+        self.job = None  # async job(user_id, search_nums); set by handlers.mailing
+
+        self.heap = []
+        self.entries = {}  # key: its live heap entry
+        self.user_searches = {}  # user_id: set of search_nums to keep polling
+        self.running = set()  # keys handed to the workers
+        self.phases = {}  # key: fraction of the interval the search is polled at
+        self.intervals = {}  # key: own interval of a search, adapted to its yield
+        self.pages = {}  # key: eBay calls a poll of the search may make
+        self.calls_per_second = 0  # sum of pages / interval over all searches
+        self.other_calls = deque()  # times of the eBay calls outside the polls, a day
+        self.dead = 0  # dead entries still in the heap
+        self.seq = itertools.count()
+        self.spread = itertools.count()
+
+        self.jobs = asyncio.Queue(queue_size)  # full queue holds the dispatcher
+        self.wake_up = asyncio.Event()
+        self.busy = 0
+        self.lags = deque(maxlen=1000)  # seconds between due and start
+
+    # ---------------------------------------------PLANNING-------------------------------------------------
+    def schedule_user(
+        self, user_id: str, search_nums, intervals: dict = {}, pages: dict = {}
+    ):
+        for search_num in self.user_searches.get(user_id, set()) - set(search_nums):
+            self.drop((user_id, search_num))
+        self.user_searches[user_id] = set(search_nums)
+        for search_num in search_nums:
+            key = (user_id, search_num)
+            self.set_interval(
+                user_id, search_num, intervals.get(search_num), pages.get(search_num)
+            )
+            if key not in self.entries and key not in self.running:
+                self.push(key, time.time())  # the first poll right away
+
+    def unschedule_user(self, user_id: str):
+        for search_num in self.user_searches.pop(user_id, ()):
+            self.drop((user_id, search_num))
+
+        if self.dead > len(self.entries):  # keep the heap mostly alive
+            self.heap = [entry for entry in self.heap if entry[-1]]
+            heapq.heapify(self.heap)
+            self.dead = 0
+
+    def drop(self, key):
+        self.phases.pop(key, None)
+        if key in self.intervals:
+            self.calls_per_second -= self.pages.pop(key) / self.intervals.pop(key)
+        entry = self.entries.pop(key, None)
+        if entry:
+            entry[-1] = False
+            self.dead += 1
+
+    def push(self, key, due):
+        entry = [due, next(self.seq), key[0], key[1], True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wake_up.set()
+
+    # ---------------------------------------------INTERVALS------------------------------------------------
+    def set_interval(
+        self, user_id: str, search_num: str, interval_seconds=None, pages=None
+    ):
+        if search_num not in self.user_searches.get(user_id, ()):
+            return  # paused meanwhile
+        key = (user_id, search_num)
+        interval_seconds = min(
+            max(interval_seconds or self.interval_seconds, settings.MIN_POLL_INTERVAL),
+            settings.MAX_POLL_INTERVAL,
+        )
+        pages = pages or self.pages.get(key, 1)
+        self.calls_per_second += pages / interval_seconds
+        if key in self.intervals:
+            self.calls_per_second -= self.pages[key] / self.intervals[key]
+        self.intervals[key] = interval_seconds
+        self.pages[key] = pages
+
+    def charge(self, calls: int = 1):
+        """eBay calls made outside the polls (ending alerts); they leave less for the polls"""
+        time_now = time.time()
+        self.other_calls.extend([time_now] * calls)
+
+    def other_calls_today(self) -> int:
+        day_ago = time.time() - 24 * 60 * 60
+        while self.other_calls and self.other_calls[0] < day_ago:
+            self.other_calls.popleft()
+        return len(self.other_calls)
+
+    def budget_scale(self) -> float:
+        # every interval is stretched by this when the searches would overspend
+        planned_calls = self.calls_per_second * 24 * 60 * 60
+        left = max(self.daily_calls - self.other_calls_today(), 1)
+        return max(1, planned_calls / left)
+
+    def interval_of(self, key) -> float:
+        return self.intervals.get(key, self.interval_seconds) * self.budget_scale()
+
+    @staticmethod
+    def adapted_interval(interval_seconds, poll_yield: float) -> float:
+        """shorter for searches that bring many new items, longer for dead ones"""
+        target = settings.TARGET_POLL_YIELD
+        factor = (target / max(poll_yield, 0.01)) ** 0.5
+        return interval_seconds * min(max(factor, 0.5), 2)
+
+    def next_due(self, key):
+        # next slot of the search on the wall-clock grid, at least half an interval away
+        if key not in self.phases:
+            self.phases[key] = (next(self.spread) * GOLDEN_RATIO) % 1
+        interval_seconds = self.interval_of(key)
+        earliest = time.time() + interval_seconds / 2
+        slot = math.ceil(earliest / interval_seconds - self.phases[key])
+        return (slot + self.phases[key]) * interval_seconds
+
+    def reschedule(self, user_id: str, searches):
+        for search_num, _ in searches:
+            key = (user_id, search_num)
+            self.running.discard(key)
+            if search_num in self.user_searches.get(user_id, ()):
+                if key not in self.entries:
+                    self.push(key, self.next_due(key))
+
+    # ---------------------------------------------RUNNING--------------------------------------------------
+    async def dispatcher(self):
+        while self.on:
+            self.wake_up.clear()
+            time_now = time.time()
+            due_users = {}
+            while self.heap and self.heap[0][0] <= time_now:
+                due, _, user_id, search_num, alive = heapq.heappop(self.heap)
+                if not alive:
+                    self.dead -= 1
+                    continue
+                key = (user_id, search_num)
+                self.entries.pop(key, None)
+                self.running.add(key)
+                due_users.setdefault(user_id, []).append((search_num, due))
+
+            for user_id, searches in due_users.items():
+                await self.jobs.put((user_id, searches))
+
+            timeout = (
+                self.heap[0][0] - time.time() if self.heap else self.interval_seconds
+            )
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), max(0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker(self):
+        while self.on:
+            user_id, searches = await self.jobs.get()
+            self.busy += 1
+            self.lags.append(time.time() - min(due for _, due in searches))
+            try:
+                await self.job(user_id, [search_num for search_num, _ in searches])
+            except Exception as e:
+                logger.error(f"Error in mailing user {user_id}: {redacted(str(e))}")
+            finally:
+                self.busy -= 1
+                self.reschedule(user_id, searches)
+                self.jobs.task_done()
+
+    async def refresher(self):
+        await asyncio.gather(
+            self.dispatcher(), *[self.worker() for _ in range(self.workers_amount)]
+        )
+
+    def stats(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "users": len(self.user_searches),
+            "scheduled": len(self.entries),
+            "queued": self.jobs.qsize(),
+            "running": self.busy,
+            "lag_avg": sum(lags) / len(lags) if lags else 0,
+            "lag_max": max(lags) if lags else 0,
+            "calls_per_day": self.calls_per_second * 24 * 60 * 60 / self.budget_scale(),
+            "other_calls": self.other_calls_today(),
+            "budget_scale": self.budget_scale(),
+        }
@@ -0,0 +1,76 @@
+"""COPIES THE MONGO COLLECTIONS OF THE BOT INTO THE SQLITE PERSISTENCE FILE
+
+python -m settings.migrate_to_sqlite
+python -m settings.migrate_to_sqlite --sqlite /data/vintage-mania.sqlite3
+
+Run it with the bot stopped, then start the bot with PERSISTENCE_BACKEND=sqlite.
+Rows already in the file are overwritten; Mongo is only read.
+"""
+import argparse
+import asyncio
+
+from logs.mylogging import logger
+from settings.settings import (
+    MONGO_URL,
+    MONGO_DB_NAME,
+    MONGO_USER_DATA_COLLECTION,
+    MONGO_BOT_DATA_COLLECTION,
+    MONGO_SEEN_ITEMS_COLLECTION,
+    SQLITE_PATH,
+    SEEN_ITEMS_KEPT,
+)
+from settings.sqlite_persistence import SQLitePersistence, dumps
+from settings.seen_store import SQLiteSeenItems
+
+BOT_DATA_ID = 0  # mongopersistence keeps bot_data as {_id: 0, content: {...}}
+SEEN_ITEMS_BATCH = 500  # users per transaction
+
+
+async def migrate(sqlite_path: str) -> dict:
+    from motor.motor_asyncio import AsyncIOMotorClient  # the optional mongo dependencies
+
+    database = AsyncIOMotorClient(MONGO_URL)[MONGO_DB_NAME]
+    persistence = SQLitePersistence(sqlite_path)
+    seen_items = SQLiteSeenItems(persistence.database, SEEN_ITEMS_KEPT)
+    counts = {"users": 0, "bot_data_keys": 0, "seen_items_users": 0}
+
+    async for document in database[MONGO_USER_DATA_COLLECTION].find():
+        user_id = document.pop("_id")
+        persistence.stage("user_data", (user_id,), dumps(document))
+        counts["users"] += 1
+    await persistence.write_pending()
+
+    document = await database[MONGO_BOT_DATA_COLLECTION].find_one({"_id": BOT_DATA_ID})
+    bot_data = document["content"] if document else {}
+    await persistence.update_bot_data(bot_data)
+    counts["bot_data_keys"] = len(bot_data)
+
+    batch = {}
+    async for document in database[MONGO_SEEN_ITEMS_COLLECTION].find():
+        batch[document["_id"]] = document["items"]
+        if len(batch) >= SEEN_ITEMS_BATCH:
+            await seen_items.write({}, batch, set())
+            counts["seen_items_users"] += len(batch)
+            batch = {}
+    await seen_items.write({}, batch, set())
+    counts["seen_items_users"] += len(batch)
+
+    await persistence.flush()
+    persistence.database.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="copy the Mongo data of the bot to SQLite")
+    parser.add_argument("--sqlite", default=SQLITE_PATH, help="the persistence file")
+    args = parser.parse_args()
+    if not MONGO_URL:
+        parser.error("MONGO_URL is not set")
+
+    counts = asyncio.run(migrate(args.sqlite))
+    logger.info(f"MIGRATED TO {args.sqlite}: {counts}")
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
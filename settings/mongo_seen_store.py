@@ -0,0 +1,45 @@
+# the Mongo backend of the seen items store; only imported when Mongo is used:
+# motor and pymongo are the optional "mongo" dependencies
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+
+# ----------------------------------------------MONGO BACKEND------------------------------------------
+class MongoSeenItems:
+    """A DOCUMENT PER USER: {_id: user_id, items: [[item_id, end_timestamp], ...]} OLDEST FIRST"""
+
+    def __init__(self, mongo_url, db_name, collection_name, kept):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.kept = kept  # items per document; new ones push the oldest out
+        self.client = None
+
+    @property
+    def collection(self):
+        # lazy: the client binds to the running loop
+        if self.client is None:
+            self.client = AsyncIOMotorClient(self.mongo_url)
+        return self.client[self.db_name][self.collection_name]
+
+    async def load(self, user_id: str) -> list:
+        document = await self.collection.find_one({"_id": user_id})
+        return document["items"] if document else []
+
+    async def write(self, appended: dict, replaced: dict, deleted: set):
+        """one bulk write: appended and replaced are {user_id: [[item_id, end], ...]}"""
+        requests = [DeleteOne({"_id": user_id}) for user_id in deleted]
+        requests += [
+            ReplaceOne({"_id": user_id}, {"items": items}, upsert=True)
+            for user_id, items in replaced.items()
+        ]
+        requests += [
+            UpdateOne(
+                {"_id": user_id},
+                {"$push": {"items": {"$each": items, "$slice": -self.kept}}},
+                upsert=True,
+            )
+            for user_id, items in appended.items()
+        ]
+        if requests:
+            await self.collection.bulk_write(requests, ordered=False)
@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+from logs.mylogging import logger, redacted
+from settings.background_tasks import BackgroundRefresher
+from settings.sqlite_persistence import read_table
+from ebay.seen_items import SeenItems
+from utils.active_users import active_users
+
+
+# ----------------------------------------------SQLITE BACKEND------------------------------------------
+class SQLiteSeenItems:
+    """A ROW PER SEEN ITEM IN THE PERSISTENCE FILE, seq KEEPS THEM OLDEST FIRST"""
+
+    def __init__(self, database, kept):
+        self.database = database  # SQLiteDatabase of the persistence
+        self.kept = kept  # rows per user; new ones push the oldest out
+
+    async def load(self, user_id: str) -> list:
+        return await self.database.run(
+            read_table,
+            "SELECT item_id, end_timestamp FROM seen_items WHERE user_id = ? ORDER BY seq",
+            user_id,
+        )
+
+    async def write(self, appended: dict, replaced: dict, deleted: set):
+        """one transaction: appended and replaced are {user_id: [[item_id, end], ...]}"""
+        if appended or replaced or deleted:
+            await self.database.run(self.write_rows, appended, replaced, deleted)
+
+    def write_rows(self, connection, appended: dict, replaced: dict, deleted: set):
+        with connection:
+            for user_id in deleted | replaced.keys():
+                connection.execute("DELETE FROM seen_items WHERE user_id = ?", (user_id,))
+            for user_id, items in (*replaced.items(), *appended.items()):
+                connection.executemany(
+                    "INSERT INTO seen_items (user_id, item_id, end_timestamp) VALUES (?, ?, ?)",
+                    [(user_id, item_id, end) for item_id, end in items[-self.kept:]],
+                )
+            for user_id in appended:
+                connection.execute(
+                    "DELETE FROM seen_items WHERE user_id = ? AND seq <= ("
+                    "SELECT seq FROM seen_items WHERE user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                    (user_id, user_id, self.kept),
+                )
+
+
+# ----------------------------------------------SEEN ITEMS STORE------------------------------------------
+class SeenStore(BackgroundRefresher):
+    """SEEN ITEMS OF EVERY USER: DECODED IN MEMORY, ONLY THE NEW ONES WRITTEN, IN BULK"""
+
+    # convention:
+    # loaded holds the SeenItems of users mailed since the start
+    # appended holds what each user saw since the last flush: the delta to write
+    # replaced users are written whole: migrated from the old bot_data["cache"]
+    # backend None keeps it all in memory (no database, load tests)
+    # stored as plain [item_id, end_timestamp] records, not SeenItems.to_bytes:
+    # a flush appends the delta ($push with $slice, INSERT rows) instead of
+    # rewriting the user's whole varint blob; decoded once per user per start
+
+    def __init__(self, app, backend, capacity, grace_seconds, flush_seconds):
+        self.process_name = "seen_items_flusher"
+        self.refresh_rate_seconds = flush_seconds
+        self.on = False
+        self.app = app
+        self.backend = backend
+        self.capacity = capacity
+        self.grace_seconds = grace_seconds
+        self.loaded = {}  # user_id: SeenItems
+        self.appended = {}  # user_id: [[item_id, end_timestamp], ...]
+        self.replaced = set()
+        self.deleted = set()
+        self.writes = 0  # users written
+        self.flush_time = 0  # IN SECONDS, the last flush
+
+    async def get(self, user_id: str) -> SeenItems:
+        seen = self.loaded.get(user_id)
+        if seen is not None:
+            return seen
+
+        legacy = self.app.bot_data.get("cache") or {}
+        if user_id in legacy:
+            seen = SeenItems.load(legacy[user_id], self.capacity, self.grace_seconds)
+            self.replaced.add(user_id)
+        elif self.backend is not None:
+            seen = SeenItems(self.capacity, self.grace_seconds)
+            for item_id, end_timestamp in await self.backend.load(user_id):
+                seen.add(item_id, end_timestamp)
+        else:
+            seen = SeenItems(self.capacity, self.grace_seconds)
+        # loaded meanwhile by another search of the user
+        return self.loaded.setdefault(user_id, seen)
+
+    def journal(self, user_id: str) -> list:
+        """newly seen items of the user go here; a flush swaps it: don't keep it"""
+        self.deleted.discard(user_id)
+        return self.appended.setdefault(user_id, [])
+
+    def drop_user(self, user_id: str):
+        self.loaded.pop(user_id, None)
+        self.appended.pop(user_id, None)
+        self.replaced.discard(user_id)
+        legacy = self.app.bot_data.get("cache")
+        if legacy:
+            legacy.pop(user_id, None)
+        self.deleted.add(user_id)
+
+    def migrate_legacy(self):
+        # the old bot_data["cache"]: {user_id: seen items} of all users in one document
+        legacy = self.app.bot_data.get("cache")
+        if legacy is None:
+            return
+        active_users(self.app.bot_data)  # its users are the active ones: index them first
+        # it's dropped from bot_data once they are written
+        for user_id, stored in legacy.items():
+            if user_id not in self.loaded:
+                seen = SeenItems.load(stored, self.capacity, self.grace_seconds)
+                self.loaded[user_id] = seen
+                self.replaced.add(user_id)
+
+    async def flush(self):
+        migrating = self.app.bot_data.get("cache") is not None
+        if migrating:
+            self.migrate_legacy()
+        if self.backend is None:
+            self.appended, self.replaced, self.deleted = {}, set(), set()
+            self.app.bot_data.pop("cache", None)
+            return
+
+        appended, replaced, deleted = self.appended, self.replaced, self.deleted
+        self.appended, self.replaced, self.deleted = {}, set(), set()
+        written = {
+            user_id: [list(item) for item in self.loaded[user_id]]
+            for user_id in replaced
+            if user_id in self.loaded
+        }
+        appended = {
+            user_id: items
+            for user_id, items in appended.items()
+            if items and user_id not in written
+        }
+        started = time.monotonic()
+        try:
+            await self.backend.write(appended, written, deleted)
+        except Exception as e:
+            logger.error(f"Error in writing seen items: {redacted(str(e))}")
+            # kept for the next flush; what came meanwhile goes after
+            for user_id, items in self.appended.items():
+                appended.setdefault(user_id, []).extend(items)
+            self.appended = appended
+            self.replaced |= replaced
+            self.deleted |= deleted - self.appended.keys()
+            return
+        self.flush_time = time.monotonic() - started
+        self.writes += len(appended) + len(written) + len(deleted)
+        if migrating:
+            legacy = self.app.bot_data.pop("cache", {})
+            logger.info(f"SEEN ITEMS OF {len(legacy)} USERS MOVED OUT OF bot_data")
+
+    async def refresher(self):
+        while self.on:
+            await asyncio.sleep(self.refresh_rate_seconds)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.loaded),
+            "dirty": len(self.appended) + len(self.replaced) + len(self.deleted),
+            "writes": self.writes,
+            "flush_time": self.flush_time,
+        }
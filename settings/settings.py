@@ -5,27 +5,115 @@ def get_secret_by_name(name: str):
     return os.getenv(name)
 
 
+# Persistence of user_data and bot_data: "mongo", or "sqlite" with no outside services
+PERSISTENCE_BACKEND = get_secret_by_name("PERSISTENCE_BACKEND") or "mongo"
+PERSISTENCE_UPDATE_INTERVAL = 60  # IN SECONDS, telegram app data is written
+SQLITE_PATH = get_secret_by_name("SQLITE_PATH") or "vintage-mania.sqlite3"
+SQLITE_WRITE_BEHIND = 5  # IN SECONDS, changes gathered into one transaction; 0 writes at once
+
 # MongoDB
 MONGO_URL = get_secret_by_name("MONGO_URL")
-MAX_CACHE_LEN = 500  # cache len per user; stored in bot_data
+MONGO_DB_NAME = "vintage-mania-database"
+MONGO_USER_DATA_COLLECTION = "user-data-collection"
+MONGO_BOT_DATA_COLLECTION = "bot-data-collection"
+MONGO_SEEN_ITEMS_COLLECTION = "seen-items-collection"
+MAX_CACHE_LEN = 500  # cache len per user; stored in its own collection, see settings/seen_store.py
+SEEN_ITEMS_KEPT = 2 * MAX_CACHE_LEN  # per user document; expired items are dropped on load
+SEEN_ITEMS_FLUSH_INTERVAL = 60  # IN SECONDS, new seen items are written in bulk
+SEEN_ITEM_END_GRACE = 60 * 60  # IN SECONDS, seen items are forgotten this long after they end
 
 # Ebay creds
 ENCODED_CREDENTIALS = get_secret_by_name("ENCODED_CREDENTIALS")
+# point it to loadtest/fake_ebay.py for load tests
+EBAY_API_URL = get_secret_by_name("EBAY_API_URL") or "https://api.ebay.com"
+
+# Ebay app token
+EBAY_TOKEN_REFRESH_AHEAD = 5 * 60  # IN SECONDS, before it expires; plus jitter
+EBAY_TOKEN_RETRIES = 5  # attempts of one refresh, with backoff
+
+# Ebay http pool; one keep-alive session for the whole app
+EBAY_POOL_LIMIT = 20  # max open connections in total
+EBAY_POOL_LIMIT_PER_HOST = 10  # max open connections to api.ebay.com
+EBAY_DNS_CACHE_TTL = 300  # IN SECONDS
+EBAY_KEEPALIVE_TIMEOUT = 120  # IN SECONDS, idle connection lifetime
+EBAY_CONNECT_TIMEOUT = 10  # IN SECONDS
+EBAY_REQUEST_TIMEOUT = 30  # IN SECONDS, the whole request
+
+# Ebay rate limiting; MAX_EBAY_API_CALLS stays the daily hard cap
+EBAY_CALLS_PER_SECOND = 2  # sustained rate
+EBAY_CALLS_BURST = 5  # calls allowed at once after being idle
+EBAY_MAX_RETRIES = 3  # retries of a call answered with 429
+EBAY_RETRY_AFTER_DEFAULT = 60  # IN SECONDS, when 429 comes without Retry-After
+
+# Newly listed searches only ask for listings after their watermark
+WATERMARK_OVERLAP = 30 * 60  # IN SECONDS, new listings reach the search with a delay
+WATERMARK_GRANULARITY = 15 * 60  # IN SECONDS, watermarks are rounded down to this
+EBAY_MAX_OFFSET = 9999  # eBay's; a backlog deeper than this can't be read on
+
+# Result pages read per search check; users may set 'pages' in a search
+EBAY_PAGE_BUDGET = 1
+MAX_EBAY_PAGE_BUDGET = 4
+
+# Ebay search results shared between users with the same search
+SEARCH_CACHE_TTL = 15 * 60  # IN SECONDS
+
+# Rendered item messages shared between users who get the same item
+RENDER_CACHE_SIZE = 4096
 
 # TG creds
 TG_BOT_TOKEN = get_secret_by_name("TG_BOT_TOKEN")
 MY_TG_ID = str(get_secret_by_name("MY_TG_ID"))
+# point it to loadtest/fake_telegram.py for load tests
+TG_API_URL = get_secret_by_name("TG_API_URL") or "https://api.telegram.org"
 
 ADMIN_GROUP = [MY_TG_ID]
 
+# Telegram sending; every bot call goes through one queue, see utils/send_queue.py
+TG_MESSAGES_PER_SECOND = 25  # all chats together; Telegram allows about 30
+TG_MESSAGES_BURST = 25  # sent at once after being idle
+TG_CHAT_INTERVAL = 1  # IN SECONDS, between messages to one user
+TG_GROUP_CHAT_INTERVAL = 3  # IN SECONDS, groups get 20 messages a minute
+TG_MAX_RETRIES = 3  # retries of a call answered with RetryAfter
+SEND_QUEUE_HIGH_WATER = 500  # found items waiting to be sent; the mailing stops polling
+SEND_QUEUE_LOW_WATER = 250  # and goes on again
+
+# Delivery modes of the found items; each user picks one with /delivery
+TG_MESSAGE_LIMIT = 4096  # characters of a text message; digests are split at it
+TG_CAPTION_LIMIT = 1024  # characters of a photo caption
+TG_ALBUM_SIZE = 10  # photos of one media group
+PHOTO_FILE_ID_CACHE_SIZE = 20000  # image urls already uploaded to Telegram, all users
+
+# Broadcasts: admin mailings, restart and shutdown notices
+BROADCAST_CONCURRENCY = 30  # recipients in the send queue at once; it keeps the rate
+BROADCAST_RETRIES = 3  # of a recipient on timeouts and network errors
+BROADCAST_RETRY_DELAY = 2  # IN SECONDS, doubled on each retry
+
+# Admin alerts; repeats of one template in a window are summed up in one message
+ADMIN_ALERT_WINDOW = 30 * 60  # IN SECONDS
+
 # Mailing settings
 MAX_EBAY_API_CALLS = 5000  # default Ebay partners program; buying-api
 MAX_OPENAI_API_CALLS = 1000  # my limit
 QUEUE_TIME_INERVAL = 3600  # IN SECONDS, 1 hour interval in mailing a user
+MIN_POLL_INTERVAL = 15 * 60  # IN SECONDS, each search adapts its own interval
+MAX_POLL_INTERVAL = 6 * 60 * 60  # IN SECONDS
+TARGET_POLL_YIELD = 0.3  # share of a poll's capacity that should be new items
+POLL_YIELD_SMOOTHING = 0.3  # weight of the last poll in the search yield average
+MAILING_WORKERS = 8  # searches of different users polled at the same time
+MAILING_QUEUE_SIZE = 100  # due searches waiting for a worker
+EBAY_CONCURRENT_SEARCHES = 8  # searches of all users fetched at the same time
+EBAY_SEARCH_TIMEOUT = 180  # IN SECONDS, all pages of one search
 MAX_SEARCHES_AMOUNT = 8  # one user can have up to 8 searches
+
+# Auction "ending soon" alerts; opt-in per user with /alerts
+ENDING_ALERT_MINUTES = 30  # default, before the auction ends
+MAX_ENDING_ALERT_MINUTES = 24 * 60
+MAX_ENDING_ALERTS = 50000  # pending alerts of all users; stored in bot_data
 MAX_USERS_AMOUNT = int(
     MAX_EBAY_API_CALLS * QUEUE_TIME_INERVAL / (24 * 60 * 60 * MAX_SEARCHES_AMOUNT)
 )
+USER_INACTIVITY_EXPIRY = 7 * 24 * 60 * 60  # IN SECONDS, no polls or commands for a week frees the slot
+INACTIVE_USERS_SWEEP_INTERVAL = 10 * 60  # IN SECONDS
 
 DEFAULT_CALL_PARAMS = {
     "q": "vintage compressor",
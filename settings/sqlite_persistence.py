@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from logs.mylogging import logger, redacted
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (key BLOB PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL, key TEXT NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS seen_items (
+    seq INTEGER PRIMARY KEY, user_id TEXT NOT NULL, item_id INTEGER NOT NULL, end_timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_items_of_user ON seen_items (user_id, seq);
+"""
+
+# a row is (table, key values): blob, None deletes it
+UPSERT = {
+    "user_data": "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+    "chat_data": "INSERT OR REPLACE INTO chat_data (chat_id, data) VALUES (?, ?)",
+    "bot_data": "INSERT OR REPLACE INTO bot_data (key, data) VALUES (?, ?)",
+    "conversations": "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+}
+DELETE = {
+    "user_data": "DELETE FROM user_data WHERE user_id = ?",
+    "chat_data": "DELETE FROM chat_data WHERE chat_id = ?",
+    "bot_data": "DELETE FROM bot_data WHERE key = ?",
+    "conversations": "DELETE FROM conversations WHERE name = ? AND key = ?",
+}
+
+
+def dumps(data) -> bytes:
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# ----------------------------------------------DATABASE------------------------------------------
+class SQLiteDatabase:
+    """ONE CONNECTION IN WAL MODE; CALLS RUN IN A THREAD, ONE AT A TIME"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")  # safe with WAL
+            self.connection.execute("PRAGMA busy_timeout=5000")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def call(self, func, *args):
+        with self.lock:
+            return func(self.connect(), *args)
+
+    async def run(self, func, *args):
+        """func(connection, *args) in a thread: the loop never waits for the disk"""
+        return await asyncio.to_thread(self.call, func, *args)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def write_rows(connection, rows: list):
+    with connection:  # one transaction
+        for (table, key), blob in rows:
+            if blob is None:
+                connection.execute(DELETE[table], key)
+            else:
+                connection.execute(UPSERT[table], (*key, blob))
+
+
+def read_table(connection, query: str, *args) -> list:
+    return connection.execute(query, args).fetchall()
+
+
+# ----------------------------------------------PERSISTENCE------------------------------------------
+class SQLitePersistence(BasePersistence):
+    """user_data, chat_data, bot_data AND CONVERSATIONS IN ONE SQLITE FILE
+
+    a row per user, per chat and per bot_data key, pickled;
+    only rows that changed since they were written are written again
+    """
+
+    # convention:
+    # written holds a digest of every row as it was last written: the dirty check
+    # pending holds the rows to write; write_behind > 0 gathers them into one transaction
+
+    def __init__(self, path: str, update_interval: float = 60, write_behind: float = 0):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=True, chat_data=True, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.database = SQLiteDatabase(path)
+        self.write_behind = write_behind  # IN SECONDS
+        self.written = {}
+        self.pending = {}
+        self.writer = None
+        self.bot_data_keys = set()
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.write_time = 0  # IN SECONDS, the last transaction
+
+    # ---------------------------------------------WRITING--------------------------------------------
+    def stage(self, table: str, key: tuple, blob):
+        row = (table, key)
+        digest = None if blob is None else hashlib.blake2b(blob, digest_size=16).digest()
+        if row not in self.pending and self.written.get(row, False) == digest:
+            self.rows_skipped += 1
+            return
+        self.pending[row] = blob
+        self.written[row] = digest
+
+    async def stage_and_write(self, table: str, key: tuple, blob):
+        self.stage(table, key, blob)
+        await self.write()
+
+    async def write(self):
+        if not self.pending:
+            return
+        if not self.write_behind:
+            await self.write_pending()
+        elif self.writer is None or self.writer.done():
+            self.writer = asyncio.ensure_future(self.write_later())
+
+    async def write_later(self):
+        await asyncio.sleep(self.write_behind)
+        await self.write_pending()
+
+    async def write_pending(self):
+        rows, self.pending = self.pending, {}
+        if not rows:
+            return
+        started = time.monotonic()
+        try:
+            await self.database.run(write_rows, list(rows.items()))
+        except Exception as e:
+            logger.error(f"Error in writing {len(rows)} rows: {redacted(str(e))}")
+            rows.update(self.pending)  # newer versions win
+            self.pending = rows
+            return
+        self.write_time = time.monotonic() - started
+        self.rows_written += len(rows)
+
+    def remember(self, table: str, key: tuple, blob: bytes):
+        # read from the file: written as it is
+        self.written[(table, key)] = hashlib.blake2b(blob, digest_size=16).digest()
+
+    # ---------------------------------------------USER DATA--------------------------------------------
+    async def get_user_data(self) -> dict:
+        rows = await self.database.run(read_table, "SELECT user_id, data FROM user_data")
+        for user_id, blob in rows:
+            self.remember("user_data", (user_id,), blob)
+        return {user_id: pickle.loads(blob) for user_id, blob in rows}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self.stage_and_write("user_data", (user_id,), dumps(data))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass  # nothing else writes the file
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.stage_and_write("user_data", (user_id,), None)
+
+    # ---------------------------------------------CHAT DATA--------------------------------------------
+    async def get_chat_data(self) -> dict:
+        rows = await self.database.run(read_table, "SELECT chat_id, data FROM chat_data")
+        for chat_id, blob in rows:
+            self.remember("chat_data", (chat_id,), blob)
+        return {chat_id: pickle.loads(blob) for chat_id, blob in rows}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self.stage_and_write("chat_data", (chat_id,), dumps(data))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self.stage_and_write("chat_data", (chat_id,), None)
+
+    # ---------------------------------------------BOT DATA--------------------------------------------
+    async def get_bot_data(self) -> dict:
+        rows = await self.database.run(read_table, "SELECT key, data FROM bot_data")
+        for key, blob in rows:
+            self.remember("bot_data", (key,), blob)
+        self.bot_data_keys = {pickle.loads(key) for key, _ in rows}
+        return {pickle.loads(key): pickle.loads(blob) for key, blob in rows}
+
+    async def update_bot_data(self, data: dict) -> None:
+        # a row per key: the small ones that change don't rewrite the big ones
+        for key, value in data.items():
+            self.stage("bot_data", (dumps(key),), dumps(value))
+        for key in self.bot_data_keys - data.keys():
+            self.stage("bot_data", (dumps(key),), None)
+        self.bot_data_keys = set(data.keys())
+        await self.write()
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # ---------------------------------------------CALLBACK DATA-----------------------------------------
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    # ---------------------------------------------CONVERSATIONS-----------------------------------------
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self.database.run(
+            read_table, "SELECT key, state FROM conversations WHERE name = ?", name
+        )
+        for key, blob in rows:
+            self.remember("conversations", (name, key), blob)
+        return {tuple(json.loads(key)): pickle.loads(blob) for key, blob in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        blob = None if new_state is None else dumps(new_state)
+        await self.stage_and_write("conversations", (name, json.dumps(key)), blob)
+
+    # ---------------------------------------------FLUSH--------------------------------------------
+    async def flush(self) -> None:
+        # the connection stays open: the seen items are flushed after it, then it's closed
+        if self.writer is not None:
+            self.writer.cancel()
+        await self.write_pending()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "written": self.rows_written,
+            "skipped": self.rows_skipped,
+            "write_time": self.write_time,
+        }
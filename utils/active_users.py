@@ -0,0 +1,73 @@
+import heapq
+import time
+
+
+# bot_data["active_users"] = {user_id: epoch of the last successful poll or command}
+# the users the bot mails; small, so it stays in bot_data
+def active_users(bot_data) -> dict:
+    index = bot_data.setdefault("active_users", {})
+    legacy = bot_data.get("cache")
+    if legacy:  # seen items still in bot_data: their users are the active ones
+        for user_id in legacy.keys() - index.keys():
+            index[user_id] = time.time()
+            activity_expiry.push(user_id, index[user_id])
+    return index
+
+
+def mark_active(bot_data, user_id: str):
+    time_now = time.time()
+    active_users(bot_data)[user_id] = time_now
+    activity_expiry.push(user_id, time_now)
+
+
+def drop_active(bot_data, user_id: str):
+    active_users(bot_data).pop(user_id, None)
+
+
+# ---------------------------------------------------EXPIRY INDEX----------------------------------------------------
+class ActivityExpiry:
+    """MIN-HEAP OF (last active, user_id): THE LONGEST SILENT USERS ARE ON TOP"""
+
+    # convention:
+    # a user polled or seen again gets a new entry; the old one is stale and skipped when
+    # it comes up: it no longer matches the time in the active users index
+    # built from the index on the first sweep, bot_data is loaded by then
+
+    def __init__(self):
+        self.heap = []
+        self.built = False
+        self.freed = 0  # slots freed since the start
+        self.stale = 0  # outdated entries skipped
+
+    def push(self, user_id: str, last_active: float):
+        if self.built:
+            heapq.heappush(self.heap, (last_active, user_id))
+
+    def build(self, index: dict):
+        self.heap = [(last_active, user_id) for user_id, last_active in index.items()]
+        heapq.heapify(self.heap)
+        self.built = True
+
+    def pop_expired(self, index: dict, older_than: float) -> list:
+        """user_ids silent since before older_than; O(k log n) for k popped"""
+        if not self.built or len(self.heap) > 2 * len(index) + 1000:
+            self.build(index)  # first sweep, or too many stale entries
+        expired = []
+        while self.heap and self.heap[0][0] < older_than:
+            last_active, user_id = heapq.heappop(self.heap)
+            if index.get(user_id) == last_active:
+                expired.append(user_id)
+            else:
+                self.stale += 1
+        self.freed += len(expired)
+        return expired
+
+    def next_expiry(self):
+        """epoch of the oldest entry, None if empty"""
+        return self.heap[0][0] if self.heap else None
+
+    def stats(self) -> dict:
+        return {"entries": len(self.heap), "freed": self.freed, "stale": self.stale}
+
+
+activity_expiry = ActivityExpiry()
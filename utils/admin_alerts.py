@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import re
+import time
+
+
+NUMBERS = re.compile(r"\d+")
+FINGERPRINT_LENGTH = 300  # chars of the normalized text; the rest rarely tells alerts apart
+
+
+def fingerprint(text: str) -> str:
+    """the template of an alert: 'user 123 - №2: ...' and 'user 456 - №1: ...' are one"""
+    return NUMBERS.sub("#", str(text))[:FINGERPRINT_LENGTH]
+
+
+# ---------------------------------------------------AGGREGATOR----------------------------------------------------
+class AlertAggregator:
+    """REPEATS OF AN ADMIN ALERT IN A WINDOW: THE FIRST GOES OUT, THE REST MAKE ONE SUMMARY"""
+
+    # convention:
+    # windows are [expires_at, repeats, last text] by fingerprint
+    # all windows are equally long: insertion order is expiry order,
+    # so expired ones are always at the front
+
+    def __init__(self, window_seconds):
+        self.window = window_seconds
+        self.windows = OrderedDict()
+        self.due = []  # (text, repeats) of windows closed early, waiting for the flush
+        self.suppressed = 0
+
+    def add(self, text, key=None) -> bool:
+        """True if the alert should go out now, False if it's a repeat in the window"""
+        time_now = time.monotonic()
+        fp = fingerprint(text) if key is None else key  # a given key is compared as is
+        window = self.windows.get(fp)
+        if window is not None:
+            if window[0] > time_now:
+                window[1] += 1
+                window[2] = text
+                self.suppressed += 1
+                return False
+            # expired and not flushed yet: its summary goes before the new window
+            del self.windows[fp]
+            if window[1]:
+                self.due.append((window[2], window[1]))
+        self.windows[fp] = [time_now + self.window, 0, text]
+        return True
+
+    def expired(self) -> list:
+        """(last text, repeats) of the closed windows that had repeats; they're forgotten"""
+        time_now = time.monotonic()
+        summaries, self.due = self.due, []
+        while self.windows:
+            fp, window = next(iter(self.windows.items()))
+            if window[0] > time_now:
+                break
+            del self.windows[fp]
+            if window[1]:
+                summaries.append((window[2], window[1]))
+        return summaries
+
+    def next_expiry_in(self):
+        """IN SECONDS, None if no window is open"""
+        if not self.windows:
+            return None
+        expires_at = next(iter(self.windows.values()))[0]
+        return max(0, expires_at - time.monotonic())
+
+    def stats(self) -> dict:
+        return {"windows": len(self.windows), "suppressed": self.suppressed}
@@ -24,6 +24,7 @@
 
 import asyncio
 from logs.mylogging import logger
+from settings.settings import MAX_EBAY_PAGE_BUDGET
 from settings.background_objects import open_ai_call_counter, notifyer
 
 from easy_open_ai import aget_answer_with_instruction
@@ -52,6 +53,7 @@ INSTRUCTION = f"""
         -  for the others, carefully check the spelling and apply your knoledge of the ebay-api-call parameters usage.
         -  some parameters may be absent.
         -  classic ebay 'filter' is allowed but forbid 'pickupRadius'.
+        - 'pages' is allowed too: how many result pages to read, a whole number from 1 to {MAX_EBAY_PAGE_BUDGET}.
 """
 
 
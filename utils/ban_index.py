@@ -0,0 +1,35 @@
+# bot_data["banned_users"] = [user_id, ...]
+# stored as a list (the database takes no sets); checked on every update, so a set
+# mirrors it in memory, rebuilt when bot_data is replaced (load at start)
+
+
+class BanIndex:
+    def __init__(self):
+        self.source = None  # the list in bot_data the set was built from
+        self.ids = set()
+
+    def banned(self, bot_data) -> set:
+        stored = bot_data.setdefault("banned_users", [])
+        if stored is not self.source:
+            self.source = stored
+            self.ids = set(stored)
+        return self.ids
+
+    def ban(self, bot_data, user_id: str) -> bool:
+        """False if the user was banned already"""
+        if user_id in self.banned(bot_data):
+            return False
+        self.ids.add(user_id)
+        self.source.append(user_id)
+        return True
+
+    def unban(self, bot_data, user_id: str) -> bool:
+        """False if the user wasn't banned"""
+        if user_id not in self.banned(bot_data):
+            return False
+        self.ids.discard(user_id)
+        self.source.remove(user_id)
+        return True
+
+
+ban_index = BanIndex()
@@ -0,0 +1,109 @@
+import asyncio
+from collections import Counter
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from logs.mylogging import logger, redacted
+from settings.settings import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_RETRIES,
+    BROADCAST_RETRY_DELAY,
+)
+from utils.send_queue import PRIORITY_ADMIN
+
+
+# outcomes of a recipient
+DELIVERED = "delivered"
+BLOCKED = "blocked"  # blocked the bot, deleted the account, never started it
+FAILED = "failed"
+
+
+# ---------------------------------------------------BROADCAST------------------------------------------------------
+async def broadcast(
+    bot,
+    chat_ids,
+    text=None,
+    photo_id=None,
+    parse_mode=None,
+    priority=PRIORITY_ADMIN,
+    concurrency=BROADCAST_CONCURRENCY,
+    notification=False,
+) -> dict:
+    """one message to many chats; a few sends at a time, the send queue keeps the rate
+
+    notification: an alert to the admins, logged at debug like a single chat; the caller logs it
+    returns {"delivered", "blocked", "failed", "elapsed", "outcomes": {chat_id: outcome}}
+    """
+    started = time.monotonic()
+    recipients = asyncio.Queue()
+    for chat_id in dict.fromkeys(map(str, chat_ids)):  # once each, in order
+        recipients.put_nowait(chat_id)
+    outcomes = {}
+
+    async def worker():
+        while not recipients.empty():
+            chat_id = recipients.get_nowait()
+            outcomes[chat_id] = await send_with_retries(
+                bot, chat_id, text, photo_id, parse_mode, priority
+            )
+
+    workers = min(concurrency, recipients.qsize())
+    await asyncio.gather(*[worker() for _ in range(workers)])
+
+    counts = Counter(outcomes.values())
+    report = {
+        DELIVERED: counts[DELIVERED],
+        BLOCKED: counts[BLOCKED],
+        FAILED: counts[FAILED],
+        "elapsed": time.monotonic() - started,
+        "outcomes": outcomes,
+    }
+    if notification or len(outcomes) <= 1:  # an admin alert or a single answer
+        logger.debug(f"BROADCAST: {summary(report)}")
+    else:
+        logger.info(f"BROADCAST: {summary(report)}")
+    return report
+
+
+async def send_with_retries(bot, chat_id, text, photo_id, parse_mode, priority):
+    for attempt in range(BROADCAST_RETRIES + 1):
+        try:
+            if photo_id:
+                await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=photo_id,
+                    caption=text,
+                    parse_mode=parse_mode,
+                    rate_limit_args=priority,
+                )
+            else:
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=parse_mode,
+                    rate_limit_args=priority,
+                )
+            return DELIVERED
+        except Forbidden:
+            return BLOCKED
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return BLOCKED
+            logger.error(f"Broadcast to {chat_id} refused: {redacted(str(e))}")
+            return FAILED
+        except (RetryAfter, NetworkError) as e:  # the send queue gave up, or timed out
+            if attempt == BROADCAST_RETRIES:
+                logger.error(f"Broadcast to {chat_id} failed: {redacted(str(e))}")
+                return FAILED
+            await asyncio.sleep(BROADCAST_RETRY_DELAY * 2**attempt)
+        except Exception as e:
+            logger.error(f"Broadcast to {chat_id} failed: {redacted(str(e))}")
+            return FAILED
+
+
+def summary(report: dict) -> str:
+    return (
+        f"{report[DELIVERED]} delivered, {report[BLOCKED]} blocked, "
+        f"{report[FAILED]} failed in {report['elapsed']:.1f}s"
+    )
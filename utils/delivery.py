@@ -0,0 +1,162 @@
+from collections import OrderedDict
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+from logs.mylogging import logger, redacted
+from settings.settings import (
+    TG_MESSAGE_LIMIT,
+    TG_CAPTION_LIMIT,
+    TG_ALBUM_SIZE,
+    PHOTO_FILE_ID_CACHE_SIZE,
+)
+
+
+# how a user gets the items of a mailing cycle; user_data["delivery"]
+DELIVERY_MODES = {
+    "items": "one message per item",
+    "digest": "all items in a few long messages",
+    "album": "photo albums of up to 10 items",
+}
+DIGEST_SEPARATOR = "\n\n" + "➖" * 8 + "\n\n"
+
+
+def tg_length(text: str) -> int:
+    # telegram counts utf-16 code units; emojis are two
+    return len(text.encode("utf-16-le")) // 2
+
+
+# -----------------------------------------------------------------PHOTO FILE IDS------------------------------------------------
+class PhotoFileIds:
+    """eBay IMAGE URL: TELEGRAM file_id OF IT, SHARED BY ALL USERS; AN IMAGE IS UPLOADED ONCE"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.file_ids = OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def media(self, url: str) -> str:
+        """what to send: the file_id if telegram has the image, else the url"""
+        file_id = self.file_ids.get(url)
+        if file_id is None:
+            self.misses += 1
+            return url
+        self.hits += 1
+        self.file_ids.move_to_end(url)
+        return file_id
+
+    def remember(self, url: str, message):
+        if not message or not message.photo:
+            return
+        self.file_ids[url] = message.photo[-1].file_id  # the biggest size
+        self.file_ids.move_to_end(url)
+        if len(self.file_ids) > self.capacity:
+            self.file_ids.popitem(last=False)
+
+    def forget(self, url: str):
+        self.file_ids.pop(url, None)
+
+    def stats(self) -> dict:
+        calls = self.hits + self.misses
+        return {
+            "entries": len(self.file_ids),
+            "hit_rate": self.hits / calls if calls else 0,
+        }
+
+
+photo_file_ids = PhotoFileIds(PHOTO_FILE_ID_CACHE_SIZE)
+
+
+# -----------------------------------------------------------------SENDING------------------------------------------------
+# items are (ItemSummary, rendered MarkdownV2 text); each returns the items delivered
+def digest_chunks(items: list) -> list:
+    """items packed into messages of TG_MESSAGE_LIMIT; an item is never split"""
+    chunks, chunk, length = [], [], 0
+    separator = tg_length(DIGEST_SEPARATOR)
+    for sr, text in items:
+        added = tg_length(text) + (separator if chunk else 0)
+        if chunk and length + added > TG_MESSAGE_LIMIT:
+            chunks.append(chunk)
+            chunk, length = [], 0
+            added = tg_length(text)
+        chunk.append((sr, text))
+        length += added
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def send_items(bot, chat_id, items: list, **send_args) -> list:
+    delivered = []
+    for sr, text in items:
+        await bot.send_message(
+            chat_id=chat_id, text=text, parse_mode="MarkDownV2", **send_args
+        )
+        delivered.append(sr)
+    return delivered
+
+
+async def send_digest(bot, chat_id, items: list, **send_args) -> list:
+    delivered = []
+    for chunk in digest_chunks(items):
+        await bot.send_message(
+            chat_id=chat_id,
+            text=DIGEST_SEPARATOR.join(text for _, text in chunk),
+            parse_mode="MarkDownV2",
+            disable_web_page_preview=True,
+            **send_args,
+        )
+        delivered += [sr for sr, _ in chunk]
+    return delivered
+
+
+async def send_albums(bot, chat_id, items: list, **send_args) -> list:
+    """items with a photo go in albums; the rest, and albums telegram refuses, in a digest"""
+    with_photo, rest = [], []
+    for sr, text in items:
+        if sr.image and tg_length(text) <= TG_CAPTION_LIMIT:
+            with_photo.append((sr, text))
+        else:
+            rest.append((sr, text))
+
+    delivered = []
+    for i in range(0, len(with_photo), TG_ALBUM_SIZE):
+        album = with_photo[i : i + TG_ALBUM_SIZE]
+        try:
+            delivered += await send_album(bot, chat_id, album, **send_args)
+        except BadRequest as e:
+            # an image telegram can't fetch fails the whole album
+            logger.error(f"Album to user {chat_id} refused: {redacted(str(e))}")
+            for sr, _ in album:
+                photo_file_ids.forget(sr.image)
+            rest += album
+    return delivered + await send_digest(bot, chat_id, rest, **send_args)
+
+
+async def send_album(bot, chat_id, album: list, **send_args) -> list:
+    if len(album) == 1:  # an album is 2 to 10 photos
+        sr, text = album[0]
+        message = await bot.send_photo(
+            chat_id=chat_id,
+            photo=photo_file_ids.media(sr.image),
+            caption=text,
+            parse_mode="MarkDownV2",
+            **send_args,
+        )
+        photo_file_ids.remember(sr.image, message)
+        return [sr]
+
+    media = [
+        InputMediaPhoto(
+            media=photo_file_ids.media(sr.image), caption=text, parse_mode="MarkDownV2"
+        )
+        for sr, text in album
+    ]
+    messages = await bot.send_media_group(chat_id=chat_id, media=media, **send_args)
+    for (sr, _), message in zip(album, messages):
+        photo_file_ids.remember(sr.image, message)
+    return [sr for sr, _ in album]
+
+
+SENDERS = {"items": send_items, "digest": send_digest, "album": send_albums}
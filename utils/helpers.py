@@ -1,4 +1,3 @@
-from datetime import datetime, timezone
 import re
 
 # from itertools import permutations
@@ -7,14 +6,20 @@ from logs.mylogging import logger
 
 from settings.settings import MAX_SEARCHES_AMOUNT
 from utils.ai_validate_call_params import ai_validate_params_input
+from utils.validate_call_params import validate_params, ACCEPT, AMBIGUOUS
+from utils.rendering import (
+    escape_markdown_v2,
+    render_ending_alert,
+    render_item,
+)
+from ebay.ebay_item import ebay_timestamp
 
 
 # --------------------------------------------------USER ADDS A SEARCH---------------------------------
 def search_formatted_to_dict(search_formatted) -> dict:
-    return {
-        i.split(":")[0].strip(): i.split(":")[1].strip()
-        for i in search_formatted.strip("\n").split("\n")
-    }
+    # only the first colon splits: filter: price:[10..50],priceCurrency:USD
+    lines = [i for i in search_formatted.strip("\n").split("\n") if i.strip()]
+    return {i.split(":", 1)[0].strip(): i.split(":", 1)[1].strip() for i in lines}
 
 
 def params_to_template(params: dict) -> str:
@@ -36,14 +41,31 @@ def next_available_search_num(storage) -> int:
     return 0
 
 
+def search_meta(user_data, search_num: str) -> dict:
+    # what the bot keeps about a search, not sent to eBay; watermark etc
+    return user_data.setdefault("search_meta", {}).setdefault(search_num, {})
+
+
+def drop_search_meta(user_data, search_num: str):
+    user_data.get("search_meta", {}).pop(search_num, None)
+
+
 async def params_input_validator(text: str) -> dict:
     no_header_lines_list = text.split("\n")[1:]
 
     try:
         diction = search_formatted_to_dict("\n".join(no_header_lines_list))
-        code, message = await ai_validate_params_input(params_to_template(diction))
-        if code == 1:
-            return diction  # returns a dictionary if all is ok
+        if not diction:
+            return diction
+
+        # the AI only sees what the local schema can't decide
+        verdict, message = validate_params(diction)
+        if verdict == ACCEPT:
+            return diction
+        if verdict == AMBIGUOUS:
+            code, message = await ai_validate_params_input(params_to_template(diction))
+            if code == 1:
+                return diction  # returns a dictionary if all is ok
 
         logger.info(f"Error parsing {text} with dict_validator: {message}")
         return message
@@ -54,90 +76,15 @@ async def params_input_validator(text: str) -> dict:
 
 
 # --------------------------------------------------OTHER HELPERS----------------------------------
-def escape_markdown_v2(text):
-    if type(text) != str:
-        text = str(text)
-    characters = [
-        "_",
-        "*",
-        "[",
-        "]",
-        "(",
-        ")",
-        "~",
-        "`",
-        ">",
-        "#",
-        "+",
-        "-",
-        "=",
-        "|",
-        "{",
-        "}",
-        ".",
-        "!",
-    ]
-    for char in characters:
-        text = text.replace(char, "\\" + char)
-    return text
+def textify_ending_alert(item_id, end_date, bidprice):
+    return render_ending_alert(item_id, ebay_timestamp(end_date), bidprice)
 
 
-def time_until(date_time_str, flag="minutes"):
-    # Parsing the date-time string to a datetime object
-    if not date_time_str:
-        return None
-    flags = {"minutes": 60, "hours": 3600, "days": 86400}
-    if date_time_str.endswith("Z"):
-        event_datetime = datetime.fromisoformat(date_time_str.replace("Z", "+00:00"))
-
-        # Getting the current datetime in UTC
-        current_datetime = datetime.now(timezone.utc)
-
-        # Calculating the difference in hours
-        time_difference = (event_datetime - current_datetime).total_seconds() / flags[
-            flag
-        ]
-
-        # If the difference is positive (i.e., the event is in the future), return the difference
-        if time_difference > 0:
-            return int(time_difference)
-        else:
-            return 0
-    else:
-        # raise ValueError
-        logger.info(
-            "helpers.time_until: The date-time string does not appear to be in UTC. Please provide a UTC date-time string."
-        )
-
-
-def textify_auction(end_date, bidprice, link):
-    result = "❗️_{} {}_\n\n💰*{}*\n\n{}"
-    flags = ["days", "hours", "minutes"]
-    for flag in flags:
-        time = time_until(end_date, flag=flag)
-        if time >= 1:
-            if time == 1:
-                flag = flag[:-1]
-            return result.format(time, flag, bidprice, link)
-        elif flag == "minutes":
-            return result.format(time, flag, bidprice, link)
-
-
-def textify_search_item(d: dict):
-    item_id = d.get("legacyItemId")
-    link = f"https://www.ebay.com/itm/{item_id}"
-    formatted_link = f"[{escape_markdown_v2(link)}]({escape_markdown_v2(link)})"
-
-    bidprice = d.get("currentBidPrice", {}).get("value")
-    if bidprice:
-        bidprice = escape_markdown_v2(bidprice)
-        end_date = d.get("itemEndDate")
-        return textify_auction(end_date, bidprice, formatted_link)
-
-    price = d.get("price", {}).get("value")
-    if price:
-        return f"💰*{escape_markdown_v2(price)}*\n\n{formatted_link}"
-    logger.info(f"helpers.textify: Item {d} returned None")
+def textify_search_item(item):
+    text = render_item(item)
+    if text is None:
+        logger.info(f"helpers.textify: Item {item.item_id} returned None")
+    return text
 
 
 # before the AI...
@@ -0,0 +1,17 @@
+# the fastest json decoder installed; the stdlib one otherwise
+try:
+    import orjson
+
+    loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson
+
+        loads = ujson.loads
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        import json
+
+        loads = json.loads
+        JSON_BACKEND = "json"
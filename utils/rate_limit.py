@@ -0,0 +1,78 @@
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import time
+
+
+# ---------------------------------------------------TOKEN BUCKET--------------------------------------------
+class TokenBucket:
+    """ASYNC TOKEN BUCKET; EVERY CALLER OF AN API WAITS IN ONE FIFO QUEUE"""
+
+    def __init__(self, name: str, rate_per_second: float, burst: int):
+        self.name = name  # api of what - EBAY, TELEGRAM, etc
+        self.rate = rate_per_second  # sustained rate
+        self.burst = burst  # max tokens saved up while idle
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0  # set by Retry-After, holds everyone
+        self.lock = asyncio.Lock()  # fair: waiters are served in order
+        self.waiting = 0
+        self.waits = deque(maxlen=1000)  # last queue-wait times, seconds
+
+    def refill(self, time_now):
+        self.tokens = min(
+            self.burst, self.tokens + (time_now - self.updated_at) * self.rate
+        )
+        self.updated_at = time_now
+
+    async def acquire(self):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self.lock:
+                while True:
+                    time_now = time.monotonic()
+                    if time_now < self.paused_until:
+                        await asyncio.sleep(self.paused_until - time_now)
+                        continue
+                    self.refill(time_now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        self.waits.append(time.monotonic() - started)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0  # no burst right after the pause
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        if not waits:
+            return {"waiting": self.waiting, "avg": 0, "p95": 0, "max": 0, "paused": 0}
+        return {
+            "waiting": self.waiting,
+            "avg": sum(waits) / len(waits),
+            "p95": waits[int(0.95 * (len(waits) - 1))],
+            "max": waits[-1],
+            "paused": max(0, self.paused_until - time.monotonic()),
+        }
+
+
+# ---------------------------------------------------HELPERS-------------------------------------------------
+def retry_after_seconds(header_value, default: float) -> float:
+    """Retry-After is either delta-seconds or an http-date"""
+    if not header_value:
+        return default
+    try:
+        return max(0, float(header_value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(header_value)
+        return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,75 @@
+from functools import lru_cache
+import time
+
+from settings.settings import RENDER_CACHE_SIZE
+
+
+# -----------------------------------------------------------------ESCAPING------------------------------------------------
+# https://core.telegram.org/bots/api#markdownv2-style
+MARKDOWN_V2_SPECIAL = "_*[]()~`>#+-=|{}.!"
+MARKDOWN_V2_ESCAPES = [(char, "\\" + char) for char in MARKDOWN_V2_SPECIAL]
+
+
+def escape_markdown_v2(text) -> str:
+    # only the characters the text has; str.translate is slower on real titles (loadtest.bench)
+    if type(text) != str:
+        text = str(text)
+    for char, escaped in MARKDOWN_V2_ESCAPES:
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
+
+
+# -----------------------------------------------------------------TEMPLATES------------------------------------------------
+# ids are digits: only the url prefix needs escaping, and only once
+ITEM_URL = escape_markdown_v2("https://www.ebay.com/itm/")
+LINK = "[" + ITEM_URL + "{item_id}](" + ITEM_URL + "{item_id})"
+AUCTION = "❗️_{left}_\n\n💰*{price}*\n\n" + LINK
+FIXED_PRICE = "💰*{price}*\n\n" + LINK
+ENDING_SOON = "⏰*Ending soon*\n\n"
+
+TIME_UNITS = ((24 * 60 * 60, "day"), (60 * 60, "hour"), (60, "minute"))
+
+
+def time_left(end_timestamp: int, time_now: float) -> str:
+    """'2 days', '1 hour', '0 minutes': the biggest unit that fits"""
+    seconds = max(0, end_timestamp - time_now)
+    for unit_seconds, unit in TIME_UNITS:
+        amount = int(seconds // unit_seconds)
+        if amount >= 1 or unit == "minute":
+            return f"{amount} {unit}" if amount == 1 else f"{amount} {unit}s"
+
+
+# -----------------------------------------------------------------RENDERING------------------------------------------------
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_body(item_id: int, price: str, left: str = None) -> str:
+    # the key is all the message depends on: an item going to many users is rendered once
+    # left is the time bucket of an auction, None for a fixed price
+    if left is None:
+        return FIXED_PRICE.format(price=escape_markdown_v2(price), item_id=item_id)
+    return AUCTION.format(left=left, price=escape_markdown_v2(price), item_id=item_id)
+
+
+def render_item(item, time_now: float = None):
+    """the feed message of an ItemSummary; None if there's no price to show"""
+    if item.bid_price:
+        if not item.end_timestamp:  # unknown end: the bid alone
+            return render_body(item.item_id, item.bid_price)
+        if time_now is None:
+            time_now = time.time()
+        return render_body(
+            item.item_id, item.bid_price, time_left(item.end_timestamp, time_now)
+        )
+    if item.price:
+        return render_body(item.item_id, item.price)
+
+
+def render_ending_alert(item_id: int, end_timestamp: int, bid_price: str):
+    left = time_left(end_timestamp, time.time()) if end_timestamp else None
+    return ENDING_SOON + render_body(item_id, bid_price, left)
+
+
+def render_cache_stats() -> dict:
+    info = render_body.cache_info()
+    calls = info.hits + info.misses
+    return {"entries": info.currsize, "hit_rate": info.hits / calls if calls else 0}
@@ -0,0 +1,221 @@
+import asyncio
+from collections import Counter
+from datetime import timedelta
+import heapq
+import itertools
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from logs.mylogging import logger
+from utils.rate_limit import TokenBucket
+
+
+# rate_limit_args of the bot methods; the lower goes first
+PRIORITY_ADMIN = 0  # admin notifications, admin and support mailings
+PRIORITY_REPLY = 1  # answers to user commands; the default
+PRIORITY_FEED = 2  # found items, ending alerts
+
+
+# ---------------------------------------------------CHAT TURNS-----------------------------------------------------
+class ChatTurns:
+    """ONE REQUEST OF A CHAT AT A TIME; THE WAITING ONES GO BY PRIORITY, THEN IN ORDER"""
+
+    # convention:
+    # waiting entries are [priority, seq, future]; cancelled futures are skipped
+    # release hands the turn straight to the next one: busy stays True meanwhile
+
+    def __init__(self):
+        self.busy = False
+        self.waiting = []
+
+    async def acquire(self, priority, seq):
+        if not self.busy:  # nobody waits when it's free: release would have woken them
+            self.busy = True
+            return
+        granted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, [priority, seq, granted])
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                self.release()  # the turn came together with the cancel: pass it on
+            raise
+
+    def release(self):
+        while self.waiting:
+            _, _, granted = heapq.heappop(self.waiting)
+            if not granted.done():
+                granted.set_result(None)
+                return
+        self.busy = False
+
+
+# ---------------------------------------------------SEND QUEUE-----------------------------------------------------
+class SendQueue(BaseRateLimiter):
+    """EVERY TELEGRAM CALL OF THE BOT: GLOBAL RATE, PER-CHAT PACING, PRIORITIES, RetryAfter"""
+
+    # convention:
+    # one request per chat at a time, the highest priority of the chat first;
+    # the next waits the chat interval after it is sent
+    # then it waits for its turn in the global queue
+    # turns are granted one token at a time, the highest priority first
+    # waiting entries are [priority, seq, future]; cancelled futures are skipped
+
+    def __init__(
+        self,
+        messages_per_second,
+        burst,
+        chat_interval,
+        group_interval,
+        max_retries,
+        high_water,
+        low_water,
+    ):
+        self.bucket = TokenBucket("TELEGRAM", messages_per_second, burst)
+        self.chat_interval = chat_interval  # IN SECONDS, private chats
+        self.group_interval = group_interval  # IN SECONDS, groups and channels
+        self.max_retries = max_retries  # per request, on RetryAfter
+        self.high_water = high_water  # feed requests in the queue; the mailing waits
+        self.low_water = low_water  # and goes on again
+
+        self.chat_next = {}  # chat id: monotonic time it can be sent to again
+        self.chat_turns = {}  # chat id: ChatTurns, while the chat has requests
+        self.chat_requests = Counter()  # chat id: requests in process
+        self.waiting = []
+        self.seq = itertools.count()
+        self.wake_up = asyncio.Event()
+        self.room = asyncio.Event()
+        self.room.set()
+        self.pending = Counter()  # priority: requests in process
+        self.retries = 0
+        self.dispatcher = None
+
+    # ---------------------------------------------PTB INTERFACE--------------------------------------------
+    async def initialize(self):
+        self.start()
+
+    async def shutdown(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        priority = PRIORITY_REPLY if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if chat_id is None:  # getMe, answerCallbackQuery, ...
+            await self.turn(priority)
+            return await callback(*args, **kwargs)
+
+        chat_id = str(chat_id)
+        self.pending[priority] += 1
+        self.update_room()
+        self.chat_requests[chat_id] += 1
+        turns = self.chat_turns.setdefault(chat_id, ChatTurns())
+        try:
+            await turns.acquire(priority, next(self.seq))
+            try:
+                return await self.send(
+                    callback, args, kwargs, endpoint, chat_id, priority
+                )
+            finally:
+                turns.release()
+        finally:
+            self.chat_requests[chat_id] -= 1
+            if not self.chat_requests[chat_id]:
+                del self.chat_requests[chat_id]
+                del self.chat_turns[chat_id]
+            self.pending[priority] -= 1
+            self.update_room()
+
+    # ---------------------------------------------PACING---------------------------------------------------
+    async def send(self, callback, args, kwargs, endpoint, chat_id, priority):
+        interval = self.group_interval if chat_id.startswith("-") else self.chat_interval
+        for attempt in range(self.max_retries + 1):
+            wait = self.chat_next.get(chat_id, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.turn(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retry_after(chat_id, e.retry_after, endpoint)
+            finally:
+                # counted from the answer: the request may have been slow to arrive
+                self.chat_next[chat_id] = max(
+                    self.chat_next.get(chat_id, 0), time.monotonic() + interval
+                )
+                if len(self.chat_next) > 10000:  # chats that can be sent to again go
+                    time_now = time.monotonic()
+                    self.chat_next = {
+                        k: v for k, v in self.chat_next.items() if v > time_now
+                    }
+
+    async def turn(self, priority):
+        self.start()
+        granted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, [priority, next(self.seq), granted])
+        self.wake_up.set()
+        await granted
+
+    def retry_after(self, chat_id, retry_after, endpoint):
+        # Telegram said too much: everyone waits, the chat the longest
+        seconds = (
+            retry_after.total_seconds()
+            if isinstance(retry_after, timedelta)
+            else float(retry_after)
+        )
+        self.retries += 1
+        self.bucket.pause(seconds)
+        self.chat_next[chat_id] = max(
+            self.chat_next.get(chat_id, 0), time.monotonic() + seconds
+        )
+        logger.info(f"TELEGRAM RetryAfter {seconds:.0f}s ON {endpoint}")
+
+    # ---------------------------------------------DISPATCHING----------------------------------------------
+    def start(self):
+        # lazy: the task has to be created inside the running loop
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+
+    async def dispatch(self):
+        while True:
+            while not self.waiting:
+                self.wake_up.clear()
+                await self.wake_up.wait()
+            await self.bucket.acquire()
+            while self.waiting:
+                _, _, granted = heapq.heappop(self.waiting)
+                if not granted.done():
+                    granted.set_result(None)
+                    break
+
+    # ---------------------------------------------BACKPRESSURE---------------------------------------------
+    def update_room(self):
+        feed = self.pending[PRIORITY_FEED]
+        if feed >= self.high_water:
+            self.room.clear()
+        elif feed <= self.low_water:
+            self.room.set()
+
+    async def wait_for_room(self):
+        """the mailing calls it before polling eBay for more items"""
+        await self.room.wait()
+
+    def stats(self) -> dict:
+        bucket = self.bucket.stats()
+        return {
+            "admin": self.pending[PRIORITY_ADMIN],
+            "replies": self.pending[PRIORITY_REPLY],
+            "feed": self.pending[PRIORITY_FEED],
+            "full": not self.room.is_set(),
+            "retries": self.retries,
+            "wait_avg": bucket["avg"],
+            "wait_p95": bucket["p95"],
+            "paused": bucket["paused"],
+        }
@@ -0,0 +1,225 @@
+# https://developer.ebay.com/api-docs/buy/browse/resources/item_summary/methods/search
+# https://developer.ebay.com/api-docs/buy/static/ref-buy-browse-filters.html
+
+# local check of the /add parameters: most inputs are clearly right or clearly wrong,
+# only the rest goes to the OpenAI validator (and its harmful content screening)
+
+from collections import Counter
+import difflib
+import re
+
+from settings.settings import MAX_EBAY_PAGE_BUDGET
+from ebay.ebay_filter import split_filter
+
+
+ACCEPT = "accept"
+REJECT = "reject"
+AMBIGUOUS = "ambiguous"
+
+CONDITIONS = {"USED", "UNSPECIFIED", "NEW"}
+BUYING_OPTIONS = {"AUCTION", "BEST_OFFER", "CLASSIFIED_AD", "FIXED_PRICE"}
+SORTS = {"price", "-price", "distance", "newlyListed", "endingSoonest"}
+MAX_LIMIT = 200  # eBay's page size limit
+MAX_OFFSET = 9999
+MAX_QUERY_LENGTH = 100
+
+# ours, turned into the filter by ebay_call.user_data_params_to_actual
+OUR_PARAMS = {"price_low", "price_up", "conditions", "buying_options", "pages"}
+EBAY_PARAMS = {
+    "q",
+    "gtin",
+    "charity_ids",
+    "fieldgroups",
+    "compatibility_filter",
+    "auto_correct",
+    "category_ids",
+    "filter",
+    "sort",
+    "limit",
+    "offset",
+    "aspect_filter",
+    "epid",
+}
+KNOWN_PARAMS = OUR_PARAMS | EBAY_PARAMS
+SEARCH_BY = ("q", "category_ids", "epid", "gtin", "charity_ids")  # eBay needs one
+FREE_FORM_PARAMS = {"aspect_filter", "compatibility_filter", "fieldgroups"}
+
+FILTERS = {
+    "bidCount",
+    "buyingOptions",
+    "charityOnly",
+    "conditionIds",
+    "conditions",
+    "deliveryCountry",
+    "deliveryOptions",
+    "deliveryPostalCode",
+    "excludeCategoryIds",
+    "excludeSellers",
+    "guaranteedDeliveryInDays",
+    "itemEndDate",
+    "itemLocationCountry",
+    "itemLocationRegion",
+    "itemStartDate",
+    "maxDeliveryCost",
+    "paymentMethods",
+    "pickupCountry",
+    "pickupPostalCode",
+    "pickupRadius",
+    "pickupRadiusUnit",
+    "price",
+    "priceCurrency",
+    "qualifiedPrograms",
+    "returnsAccepted",
+    "searchInDescription",
+    "sellerAccountTypes",
+    "sellers",
+}
+BANNED_FILTERS = {"pickupRadius"}
+
+NUMBER = re.compile(r"^\d+(\.\d+)?$")
+DIGITS_LIST = re.compile(r"^\d+(,\d+)*$")
+# plain words and the usual punctuation; anything else is for the AI to judge
+PLAIN_QUERY = re.compile(r"^[\w\s\-'\"&.,()/+#%*!?]+$")
+
+
+verdicts = Counter()  # of the inputs checked since the start
+
+
+# ---------------------------------------------------HELPERS----------------------------------------------------
+def did_you_mean(name: str, known) -> str:
+    close = difflib.get_close_matches(name, known, n=1)
+    return f" Did you mean '{close[0]}'?" if close else ""
+
+
+def check_enum(name: str, value: str, allowed: set) -> list:
+    if "," in value:
+        return [f"'{name}' values are separated with '|', not ',': {value.replace(',', '|').strip('|')}"]
+    wrong = [option for option in value.split("|") if option.strip() not in allowed]
+    if wrong:
+        return [
+            f"'{name}' can't be {', '.join(wrong)}; "
+            f"it takes {', '.join(sorted(allowed))} joined with '|'"
+        ]
+    return []
+
+
+def check_whole_number(name: str, value: str, low: int, high: int) -> list:
+    if not value.isdigit() or not low <= int(value) <= high:
+        return [f"'{name}' must be a whole number from {low} to {high}"]
+    return []
+
+
+def check_price(value: str):
+    # (errors, price or None)
+    if not NUMBER.match(value):
+        return [f"price must be a number, not '{value}'"], None
+    return [], float(value)
+
+
+# ---------------------------------------------------FILTER----------------------------------------------------
+def check_filter(filter_line: str):
+    """(errors, ambiguous) of an eBay filter: name:value, name:[low..up], name:{a|b}"""
+    errors, ambiguous = [], False
+    names = {}
+    for token in split_filter(filter_line):
+        token = token.strip()
+        if not token:
+            errors.append("the filter has an empty part between commas")
+            continue
+        name, colon, value = token.partition(":")
+        name, value = name.strip(), value.strip()
+        if not colon or not value:
+            errors.append(f"filter part '{token}' must look like name:value")
+            continue
+        if name in BANNED_FILTERS:
+            errors.append(f"'{name}' is not allowed in the filter")
+            continue
+        if name not in FILTERS:
+            suggestion = did_you_mean(name, FILTERS)
+            if suggestion:
+                errors.append(f"unknown filter '{name}'.{suggestion}")
+            else:
+                ambiguous = True  # newer eBay filters are not listed here
+            continue
+        is_range = value.startswith("[") and value.endswith("]")  # [low..up], [low], [..up]
+        is_set = value.startswith("{") and value.endswith("}")
+        if any(bracket in value for bracket in "[]{}") and not (is_range or is_set):
+            errors.append(f"filter '{name}' has a broken value '{value}': use [low..up] or {{A|B}}")
+            continue
+        names[name] = value
+
+    if "price" in names:
+        if "priceCurrency" not in names:
+            errors.append("the price filter needs priceCurrency too, e.g. priceCurrency:USD")
+        low, _, up = names["price"].strip("[]").partition("..")
+        bounds = []
+        for bound in (low, up):
+            if bound:
+                bound_errors, price = check_price(bound.strip())
+                errors += bound_errors
+                bounds.append(price)
+        if len(bounds) == 2 and None not in bounds and bounds[0] >= bounds[1]:
+            errors.append("in the price filter the lower price must be below the upper one")
+    for name, allowed in (("conditions", CONDITIONS), ("buyingOptions", BUYING_OPTIONS)):
+        if name in names:
+            errors += check_enum(f"filter {name}", names[name].strip("{}"), allowed)
+    return errors, ambiguous
+
+
+# ---------------------------------------------------VALIDATOR----------------------------------------------------
+def validate_params(params: dict):
+    """(ACCEPT | REJECT | AMBIGUOUS, message for the user)"""
+    errors, ambiguous = [], False
+
+    for name, value in params.items():
+        if name not in KNOWN_PARAMS:
+            errors.append(f"unknown parameter '{name}'.{did_you_mean(name, KNOWN_PARAMS)}")
+        elif not value:
+            errors.append(f"'{name}' has no value")
+        elif name in FREE_FORM_PARAMS:
+            ambiguous = True  # their own grammar, left to the AI
+
+    if not any(params.get(name) for name in SEARCH_BY):
+        errors.append("add 'q' with the words to search for")
+
+    query = params.get("q", "")
+    if len(query) > MAX_QUERY_LENGTH:
+        errors.append(f"'q' is too long: at most {MAX_QUERY_LENGTH} characters")
+    elif query and not PLAIN_QUERY.match(query):
+        ambiguous = True
+
+    prices = {}
+    for name in ("price_low", "price_up"):
+        if params.get(name):
+            price_errors, prices[name] = check_price(params[name])
+            errors += [f"'{name}': {error}" for error in price_errors]
+    if None not in prices.values() and len(prices) == 2 and prices["price_low"] >= prices["price_up"]:
+        errors.append("'price_low' must be below 'price_up'")
+
+    if params.get("conditions"):
+        errors += check_enum("conditions", params["conditions"], CONDITIONS)
+    if params.get("buying_options"):
+        errors += check_enum("buying_options", params["buying_options"], BUYING_OPTIONS)
+    if params.get("sort") and params["sort"] not in SORTS:
+        errors.append(
+            f"'sort' can be {', '.join(sorted(SORTS))}.{did_you_mean(params['sort'], SORTS)}"
+        )
+    if params.get("limit"):
+        errors += check_whole_number("limit", params["limit"], 1, MAX_LIMIT)
+    if params.get("offset"):
+        errors += check_whole_number("offset", params["offset"], 0, MAX_OFFSET)
+    if params.get("pages"):
+        errors += check_whole_number("pages", params["pages"], 1, MAX_EBAY_PAGE_BUDGET)
+    for name in ("category_ids", "charity_ids"):
+        if params.get(name) and not DIGITS_LIST.match(params[name]):
+            errors.append(f"'{name}' takes numbers separated with ','")
+    if params.get("filter"):
+        filter_errors, filter_ambiguous = check_filter(params["filter"])
+        errors += filter_errors
+        ambiguous = ambiguous or filter_ambiguous
+
+    verdict = REJECT if errors else AMBIGUOUS if ambiguous else ACCEPT
+    verdicts[verdict] += 1
+    if errors:
+        return verdict, "Please fix your search:\n\n" + "\n".join(f"- {e}" for e in errors)
+    return verdict, ""